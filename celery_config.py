@@ -22,6 +22,9 @@ app = celery.Celery(
     include=[
         'ducatus_exchange.payments.tasks',
         'ducatus_exchange.exchange_requests.tasks',
+        'ducatus_exchange.transfers.tasks',
+        'ducatus_exchange.rates.tasks',
+        'ducatus_exchange.mails.tasks',
     ]
 )
 
@@ -78,5 +81,21 @@ app.conf.beat_schedule = {
     'update_duc_and_ducx_balances': {
         'task': 'ducatus_exchange.exchange_requests.tasks.update_duc_and_ducx_balances',
         'schedule': crontab(minute='*'),
+    },
+    'process_stuck_ducx_transactions': {
+        'task': 'ducatus_exchange.transfers.tasks.process_stuck_ducx_transactions',
+        'schedule': crontab(minute='*'),
+    },
+    'deliver_payment_transitions': {
+        'task': 'ducatus_exchange.payments.tasks.deliver_payment_transitions',
+        'schedule': crontab(minute='*'),
+    },
+    'send_queued_mails': {
+        'task': 'ducatus_exchange.mails.tasks.send_queued_mails',
+        'schedule': crontab(minute='*'),
+    },
+    'downsample_rates_history': {
+        'task': 'ducatus_exchange.rates.tasks.downsample_rates_history',
+        'schedule': crontab(hour=1, minute=0),
     }
 }
@@ -1,51 +1,123 @@
 import json
 import time
-import requests
+import logging
+import threading
+from http.client import HTTPException
+
 from bitcoinrpc.authproxy import AuthServiceProxy
 
-from ducatus_exchange.settings import NETWORK_SETTINGS
+from ducatus_exchange.settings import NETWORK_SETTINGS, BTC_FEE_CACHE_TTL, BTC_FEE_TARGET_BLOCKS
 from ducatus_exchange.consts import DECIMALS
+from ducatus_exchange.http_client import HttpClient
+
+logger = logging.getLogger(__name__)
+
+_node_versions = {}
+_node_versions_lock = threading.Lock()
+
+
+class FeeEstimator:
+    """
+    BTC transaction fee from bitcore api, cached for BTC_FEE_CACHE_TTL seconds
+
+    When bitcore is not available fee is estimated by node with estimatesmartfee,
+    last known fee is used if both sources fail
+    """
+
+    def __init__(self, network):
+        self.client = HttpClient(f'https://api.bitcore.io/api/BTC/{network}')
+        self.lock = threading.Lock()
+        self.fee = None
+        self.fetched_at = 0
+
+    def get_fee(self, rpc):
+        with self.lock:
+            if self.fee is not None and time.monotonic() - self.fetched_at < BTC_FEE_CACHE_TTL:
+                return self.fee
+            try:
+                fee = self.fetch_fee(rpc)
+            except Exception as e:
+                if self.fee is None:
+                    raise
+                logger.warning(msg=f'cannot get BTC fee, last known {self.fee} is used: {e!r}')
+                return self.fee
+            self.fee = fee
+            self.fetched_at = time.monotonic()
+            return self.fee
+
+    def fetch_fee(self, rpc):
+        try:
+            res = self.client.get(f'/fee/{BTC_FEE_TARGET_BLOCKS}', endpoint='/fee')
+            res.raise_for_status()
+            return int(json.loads(res.text)['feerate'] * DECIMALS['BTC'])
+        except Exception as e:
+            logger.warning(msg=f'cannot get BTC fee from bitcore, estimating on node: {e!r}')
+        estimation = rpc.call('estimatesmartfee', BTC_FEE_TARGET_BLOCKS)
+        return int(estimation['feerate'] * DECIMALS['BTC'])
+
+
+# fee was always taken from mainnet api
+fee_estimator = FeeEstimator('mainnet')
 
 
 class BitcoinRPC:
-    def __init__(self):
-        self.connection = None
-        self.network_info = None
-        self.version = None
-        self.relay_fee = None
-        self.establish_connection()
+    """
+    BTC node client with one persistent connection
 
-    def establish_connection(self):
-        endpoint = 'http://{user}:{pwd}@{host}:{port}'.format(
+    Node version is requested once per process, connection is recreated only when it is lost
+    """
+
+    def __init__(self):
+        self.endpoint = 'http://{user}:{pwd}@{host}:{port}'.format(
             user=NETWORK_SETTINGS['BTC']['user'],
             pwd=NETWORK_SETTINGS['BTC']['password'],
             host=NETWORK_SETTINGS['BTC']['host'],
             port=NETWORK_SETTINGS['BTC']['port']
         )
-        print(endpoint)
-        self.connection = AuthServiceProxy(endpoint)
-        self.network_info = self.connection.getnetworkinfo()
-        self.version = int(str(self.network_info['version'])[:2])
-        res = requests.get('https://api.bitcore.io/api/BTC/mainnet/fee/3')
-        self.relay_fee = int(json.loads(res.text)['feerate'] * DECIMALS['BTC'])
+        self.connection = None
+
+    def establish_connection(self):
+        self.connection = AuthServiceProxy(self.endpoint)
 
     def reconnect(self):
         self.establish_connection()
 
+    def call(self, method, *args):
+        """ Calls node method, on lost connection reconnects and retries once unless transaction is sent """
+        if self.connection is None:
+            self.establish_connection()
+        try:
+            return getattr(self.connection, method)(*args)
+        except (ConnectionError, HTTPException) as e:
+            self.reconnect()
+            if method == 'sendrawtransaction':
+                raise
+            logger.warning(msg=f'BTC node connection lost on {method}, reconnecting: {e!r}')
+            return getattr(self.connection, method)(*args)
+
+    @property
+    def version(self):
+        with _node_versions_lock:
+            if self.endpoint not in _node_versions:
+                network_info = self.call('getnetworkinfo')
+                _node_versions[self.endpoint] = int(str(network_info['version'])[:2])
+            return _node_versions[self.endpoint]
+
+    @property
+    def relay_fee(self):
+        return fee_estimator.get_fee(self)
+
     def create_raw_transaction(self, input_params, output_params):
-        self.reconnect()
-        return self.connection.createrawtransaction(input_params, output_params)
+        return self.call('createrawtransaction', input_params, output_params)
 
     def sign_raw_transaction(self, tx, private_key):
-        self.reconnect()
         if self.version >= 17:
-            return self.connection.signrawtransactionwithkey(tx, [private_key])
+            return self.call('signrawtransactionwithkey', tx, [private_key])
         else:
-            return self.connection.signrawtransaction(tx, None, [private_key])
+            return self.call('signrawtransaction', tx, None, [private_key])
 
     def send_raw_transaction(self, tx_hex):
-        self.reconnect()
-        return self.connection.sendrawtransaction(tx_hex)
+        return self.call('sendrawtransaction', tx_hex)
 
     def construct_and_send_tx(self, input_params, output_params, private_key):
         tx = self.create_raw_transaction(input_params, output_params)
@@ -62,8 +134,7 @@ class BitcoinRPC:
             return None
 
     def validateaddress(self, address):
-        self.reconnect()
-        return self.connection.validateaddress(address)
+        return self.call('validateaddress', address)
 
 
 class BitcoinAPI:
@@ -74,14 +145,15 @@ class BitcoinAPI:
                 self.network = 'mainnet'
 
         self.base_url = None
+        self.client = None
         self.set_base_url()
 
     def set_base_url(self):
         self.base_url = f'https://api.bitcore.io/api/BTC/{self.network}'
+        self.client = HttpClient(self.base_url)
 
     def get_address_response(self, address):
-        endpoint_url = f'{self.base_url}/address/{address}/?limit=1000'
-        res = requests.get(endpoint_url)
+        res = self.client.get(f'/address/{address}/', endpoint='/address', params={'limit': 1000})
         if not res.ok:
             return [], False
         else:
@@ -135,8 +207,7 @@ class BitcoinAPI:
         return input_params, input_value, True
 
     def get_return_address(self, tx_hash):
-        endpoint_url = f'{self.base_url}/tx/{tx_hash}/coins'
-        res = requests.get(endpoint_url)
+        res = self.client.get(f'/tx/{tx_hash}/coins', endpoint='/tx/coins')
         if not res.ok:
             return '', False
         else:
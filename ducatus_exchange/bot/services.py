@@ -1,42 +1,117 @@
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.apihelper import ApiTelegramException
 
-from django.db import transaction
 from ducatus_exchange.bot.models import BotSub, BotSwapMessage
 from ducatus_exchange.bot.base import Bot
-from ducatus_exchange.settings import NETWORK_SETTINGS
+from ducatus_exchange.http_client import RateLimiter
+from ducatus_exchange.settings import NETWORK_SETTINGS, BOT_MESSAGES_PER_SECOND, BOT_SEND_WORKERS, BOT_MAX_RETRIES
 
 
 logger = logging.getLogger('bot')
 
+_rate_limiter = RateLimiter(BOT_MESSAGES_PER_SECOND)
+
 
-@transaction.atomic
-def send_or_update_message(payment):
-    subs = BotSub.objects.all()
-    message = generate_message(payment)
-    for sub in subs:
+def call_telegram(method, *args, **kwargs):
+    """ Calls Telegram API method within messages rate limit, waits and retries when Telegram asks to """
+    for attempt in range(BOT_MAX_RETRIES):
+        _rate_limiter.wait()
         try:
-            message_model, created = BotSwapMessage.objects.select_for_update().get_or_create(
-                payment_id=payment.id, sub=sub,
-            )
-            if created:
-                message_model.message_id = Bot().bot.send_message(
-                    sub.chat_id, 
-                    message, 
-                    parse_mode='html', 
-                    disable_web_page_preview=True
-                ).message_id
-                message_model.save()
-            else:
-                Bot().bot.edit_message_text(
-                    message, 
-                    sub.chat_id, 
-                    message_model.message_id, 
+            return method(*args, **kwargs)
+        except ApiTelegramException as e:
+            if e.error_code != 429 or attempt == BOT_MAX_RETRIES - 1:
+                raise
+            retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+            logger.warning(msg=f'Telegram rate limit reached, retry after {retry_after} seconds')
+            time.sleep(retry_after)
+
+
+def is_retryable(error):
+    """ Telegram errors which can succeed on next attempt, others (blocked bot, bad request) never will """
+    return not isinstance(error, ApiTelegramException) or error.error_code not in (400, 403)
+
+
+def send_or_update_messages(payments):
+    """
+    Sends current state of every payment to every subscriber, editing already sent messages
+
+    Messages are sent concurrently and no database locks are held while Telegram is called.
+    Returns ids of payments delivered to every subscriber, non-retryable errors count as delivered
+    """
+    subs = list(BotSub.objects.all())
+    if not payments or not subs:
+        return set(payment.id for payment in payments)
+
+    bot = Bot().bot
+    sent_messages = {
+        (payment_id, sub_id): message_id
+        for payment_id, sub_id, message_id in BotSwapMessage.objects.filter(
+            payment_id__in=[payment.id for payment in payments]
+        ).values_list('payment_id', 'sub_id', 'message_id')
+    }
+
+    def notify(payment, message, sub):
+        message_id = sent_messages.get((payment.id, sub.id))
+        try:
+            if message_id:
+                call_telegram(
+                    bot.edit_message_text,
+                    message,
+                    sub.chat_id,
+                    message_id,
                     parse_mode='html',
                     disable_web_page_preview=True
                 )
+                return True, None
+            message_id = call_telegram(
+                bot.send_message,
+                sub.chat_id,
+                message,
+                parse_mode='html',
+                disable_web_page_preview=True
+            ).message_id
+            return True, BotSwapMessage(payment_id=payment.id, sub=sub, message_id=message_id)
         except Exception as e:
-            logger.error(msg=f'send_or_update_message FAILED on payment: {payment.id} with exception: \n {e}')
-    logger.info(msg=f'send_or_update_message SUCCEDED on payment: {payment.id}')
+            if isinstance(e, ApiTelegramException) and 'message is not modified' in e.description:
+                return True, None
+            logger.error(msg=f'send_or_update_messages FAILED on payment: {payment.id}, sub: {sub.id} '
+                             f'with exception: \n {e}')
+            return not is_retryable(e), None
+
+    failed_payments = set()
+    new_messages = []
+    with ThreadPoolExecutor(max_workers=BOT_SEND_WORKERS) as executor:
+        futures = []
+        for payment in payments:
+            try:
+                message = generate_message(payment)
+            except Exception as e:
+                logger.error(msg=f'cannot generate message for payment: {payment.id} with exception: \n {e}')
+                failed_payments.add(payment.id)
+                continue
+            futures.extend((payment.id, executor.submit(notify, payment, message, sub)) for sub in subs)
+        for payment_id, future in futures:
+            delivered, new_message = future.result()
+            if not delivered:
+                failed_payments.add(payment_id)
+            if new_message:
+                new_messages.append(new_message)
+
+    # messages which were created before without id are updated, others are inserted
+    for new_message in new_messages:
+        if (new_message.payment_id, new_message.sub_id) in sent_messages:
+            BotSwapMessage.objects.filter(payment_id=new_message.payment_id, sub=new_message.sub) \
+                .update(message_id=new_message.message_id)
+    BotSwapMessage.objects.bulk_create(
+        [message for message in new_messages if (message.payment_id, message.sub_id) not in sent_messages],
+        ignore_conflicts=True
+    )
+    delivered_payments = set(payment.id for payment in payments) - failed_payments
+    logger.info(msg=f'send_or_update_messages SUCCEDED on payments: {sorted(delivered_payments)}')
+    return delivered_payments
 
 
 def generate_message(payment):
@@ -61,6 +136,9 @@ def generate_message(payment):
         return f'returned: {from_tx_hyperlinked} → {return_tx_hyperlinked}'
     else:
         transfer = payment.transfers.first()
+        if transfer is None:
+            # payment failed before anything was sent
+            return f'error: {from_tx_hyperlinked}'
         to_network = NETWORK_SETTINGS[transfer.currency]
         to_amount = f'{transfer.amount / (10 ** to_network["decimals"])} {transfer.currency}'
         to_tx_url = to_network['explorer_url'] + '/'.join(['tx', transfer.tx_hash])
@@ -68,4 +146,6 @@ def generate_message(payment):
         if payment.transfer_state == 'PENDING':
             return f'pending: {from_tx_hyperlinked} → {to_tx_hyperlinked}'
         elif payment.transfer_state == 'DONE':
-            return f'success: {from_tx_hyperlinked} → {to_tx_hyperlinked}'
\ No newline at end of file
+            return f'success: {from_tx_hyperlinked} → {to_tx_hyperlinked}'
+        else:
+            return f'error: {from_tx_hyperlinked} → {to_tx_hyperlinked}'
\ No newline at end of file
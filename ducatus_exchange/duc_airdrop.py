@@ -34,6 +34,7 @@ def duc_airdrop(duc_amount):
             airdrop_reader = csv.reader(infile)
 
             addresses = []
+            ducatus_api = DucatuscoreInterface()
 
             for row in airdrop_reader:
 
@@ -49,15 +50,13 @@ def duc_airdrop(duc_amount):
 
                 for duc_address in address_batch:
 
-                    address_api = DucatuscoreInterface()
-                    is_valid = address_api.rpc.validateaddress(duc_address)
+                    is_valid = ducatus_api.rpc.validateaddress(duc_address)
                     # print(is_valid)
                     if is_valid.get('isvalid'):
 
                         transfers[duc_address] = duc_amount
 
                 print('transfer', transfers)
-                ducatus_api = DucatuscoreInterface()
                 try:
                     ducatus_api.rpc.walletpassphrase(ducatus_api.settings['wallet_password'], 30)
                     transfer_hash = ducatus_api.rpc.sendmany("", transfers)
@@ -1,6 +1,4 @@
-from time import time
 from django.http.response import Http404
-import requests
 import datetime
 import logging
 from decimal import Decimal
@@ -9,9 +7,10 @@ from web3 import Web3, HTTPProvider
 
 from ducatus_exchange.payments.models import Payment
 from ducatus_exchange.consts import DECIMALS
+from ducatus_exchange.http_client import HttpClient
 from ducatus_exchange.litecoin_rpc import DucatuscoreInterface
 from ducatus_exchange.bip32_ducatus import DucatusWallet
-from ducatus_exchange.parity_interface import ParityInterface
+from ducatus_exchange.transfers.scheduler import DucxTransactionScheduler
 from ducatus_exchange.settings import ROOT_KEYS, STATS_NORMALIZED_TIME, DUCX_GAS_PRICE, NETWORK_SETTINGS, DUCX_TRANSFER_GAS_LIMIT
 from ducatus_exchange.withdrawals.utils import get_private_keys
 
@@ -22,11 +21,11 @@ class DucatusAPI:
 
     def __init__(self):
         self.network = 'testnet' if NETWORK_SETTINGS['DUC']['is_testnet'] else 'mainnet'
-        self.base_url = f'https://ducapi.rocknblock.io/api/DUC/{self.network}'        
+        self.base_url = f'https://ducapi.rocknblock.io/api/DUC/{self.network}'
+        self.client = HttpClient(self.base_url)
 
     def get_address_response(self, address):
-        endpoint_url = f'{self.base_url}/address/{address}'
-        res = requests.get(endpoint_url)
+        res = self.client.get(f'/address/{address}', endpoint='/address')
         if not res.ok:
             return [], False
         else:
@@ -80,8 +79,7 @@ class DucatusAPI:
         return input_params, input_value, True
 
     def get_return_address(self, tx_hash):
-        endpoint_url = f'{self.base_url}/tx/{tx_hash}/coins'
-        res = requests.get(endpoint_url)
+        res = self.client.get(f'/tx/{tx_hash}/coins', endpoint='/tx/coins')
         if not res.ok:
             return '', False, res
         else:
@@ -101,16 +99,13 @@ class DucatusAPI:
         return return_address, address_found, res
 
     def get_last_blockchain_block(self):
-        req_string = f'{self.base_url}/block/tip'
-        res = requests.get(req_string)
+        res = self.client.get('/block/tip')
         data = res.json()
         blockchain_last_block = data["height"]
         return blockchain_last_block
 
     def get_block_transactions(self, block_number):
-        req_string = f'{self.base_url}/tx?blockHeight=' + str(block_number)
-        # print(f'block transaction string: {req_string}')
-        res = requests.get(req_string)
+        res = self.client.get('/tx', endpoint='/tx?blockHeight', params={'blockHeight': block_number})
         data = res.json()
 
         sending_transactions = []
@@ -150,30 +145,25 @@ class DucatusAPI:
         return value
 
     def get_last_block_time(self, block):
-        req_string = f'{self.base_url}/block/{block}'
-        res = requests.get(req_string)
+        res = self.client.get(f'/block/{block}', endpoint='/block')
         data = res.json()
         time = data.get('time')
         time_date = datetime.datetime.strptime(time, STATS_NORMALIZED_TIME)
         return time_date
 
     def get_address_balance(self, address):
-        req_string = f'{self.base_url}/address/{address}/balance'
-        # print(f'address balance string {req_string}', flush=True)
-        res = requests.get(req_string)
+        res = self.client.get(f'/address/{address}/balance', endpoint='/address/balance')
         data = res.json()
         balance = int(float(data.get('balance')))
         return balance
 
     def get_transaction_by_hash(self, tx_hash):
-        req_string = f'{self.base_url}/tx/{tx_hash}'
-        res = requests.get(req_string)
+        res = self.client.get(f'/tx/{tx_hash}', endpoint='/tx')
         data = res.json()
         return data
 
     def get_tx_addresses(self, tx_hash):
-        endpoint_url = f'{self.base_url}/tx/{tx_hash}/coins'
-        res = requests.get(endpoint_url)
+        res = self.client.get(f'/tx/{tx_hash}/coins', endpoint='/tx/coins')
         data = res.json()
         addresses = []
         for tx_input in data['inputs']:
@@ -194,13 +184,15 @@ class DucatusXAPI(DucatusAPI):
     def __init__(self):
         super().__init__()
         self.base_url = f'https://ducapi.rocknblock.io/api/DUCX/{self.network}'
+        self.client = HttpClient(self.base_url)
 
     def get_tx_value(self, tx):
         return tx.get('value')
 
 
-def return_ducatus(payment_hash, amount):
-    p = Payment.objects.get(tx_hash=payment_hash)
+def return_ducatus(payment_id, amount):
+    # one transaction can pay several exchange requests, so payment is looked up by id, not by tx hash
+    p = Payment.objects.get(id=payment_id)
 
     duc_root_key = DucatusWallet.deserialize(ROOT_KEYS['ducatus']['private'])
     duc_child = duc_root_key.get_child(p.exchange_request.user.id, is_prime=False)
@@ -267,13 +259,13 @@ def return_ducatus(payment_hash, amount):
     logger.info(msg=f'receive address was: {p.exchange_request.duc_address}')
 
 
-def return_ducatusx(payment_hash, amount):
-    payment = Payment.objects.get(tx_hash=payment_hash)
+def return_ducatusx(payment_id, amount):
+    payment = Payment.objects.get(id=payment_id)
 
     exchange_request = payment.exchange_request
 
     w3 = Web3(HTTPProvider(NETWORK_SETTINGS['DUCX']['url']))
-    receipt = w3.eth.getTransactionReceipt(payment_hash)
+    receipt = w3.eth.getTransactionReceipt(payment.tx_hash)
     receiver = receipt['from']
     amount -= DUCX_GAS_PRICE * DUCX_TRANSFER_GAS_LIMIT
 
@@ -285,7 +277,7 @@ def return_ducatusx(payment_hash, amount):
         amount=amount / DECIMALS['DUCX']
     ))
 
-    tx_hash = ParityInterface().transfer(
+    tx_hash = DucxTransactionScheduler().send(
         receiver,
         amount,
         from_address=exchange_request.ducx_address,
@@ -299,5 +291,3 @@ def return_ducatusx(payment_hash, amount):
     payment.returned_tx_hash = tx_hash
     payment.state_transfer_returned()
     payment.save()
-
-    time.sleep(100)    # small timeout in case of multiple payment messages
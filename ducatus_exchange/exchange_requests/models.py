@@ -2,6 +2,7 @@ from bip32utils import BIP32Key
 from eth_keys import keys
 
 from django.db import models
+from django.utils import timezone
 
 from ducatus_exchange.consts import MAX_DIGITS, DECIMALS
 from ducatus_exchange.settings import ROOT_KEYS
@@ -15,13 +16,19 @@ class DucatusUser(models.Model):
     email = models.CharField(max_length=50, null=True, default=None)
     ref_address = models.CharField(max_length=50, null=True, default=None)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['address', 'platform']),
+        ]
+
 
 class ExchangeRequest(models.Model):
     user = models.ForeignKey(DucatusUser, on_delete=models.CASCADE, null=True)
-    duc_address = models.CharField(max_length=50, null=True, default=None)
-    ducx_address = models.CharField(max_length=50, null=True, default=None)
-    btc_address = models.CharField(max_length=50, null=True, default=None)
-    eth_address = models.CharField(max_length=50, null=True, default=None)
+    # ducx and eth addresses are stored lowercased, lookups should lowercase them too instead of iexact
+    duc_address = models.CharField(max_length=50, null=True, default=None, db_index=True)
+    ducx_address = models.CharField(max_length=50, null=True, default=None, db_index=True)
+    btc_address = models.CharField(max_length=50, null=True, default=None, db_index=True)
+    eth_address = models.CharField(max_length=50, null=True, default=None, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     dayly_swap = models.DecimalField(max_digits=MAX_DIGITS, decimal_places=0, default=0)
     weekly_swap = models.DecimalField(max_digits=MAX_DIGITS, decimal_places=0, default=0)
@@ -50,6 +57,18 @@ class ExchangeRequest(models.Model):
         self.save()
 
 
+class FundedAddress(models.Model):
+    """ Deposit address of exchange request which received payment since it was last swept """
+    exchange_request = models.ForeignKey(ExchangeRequest, on_delete=models.CASCADE, related_name='funded_addresses')
+    network = models.CharField(max_length=10)
+    funded_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['exchange_request', 'network'], name='unique_funded_address'),
+        ]
+
+
 class ExchangeStatus(models.Model):
     status = models.BooleanField(default=True)
     updated_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,56 @@
+from django.test import TestCase
+
+from ducatus_exchange.consts import DAYLY_LIMIT, WEEKLY_LIMIT
+from ducatus_exchange.exchange_requests.models import DucatusUser, ExchangeRequest
+from ducatus_exchange.exchange_requests.utils import reserve_swap_limits
+
+
+class ReserveSwapLimitsTest(TestCase):
+    def setUp(self):
+        user = DucatusUser.objects.create(address='0xuser', platform='DUCX')
+        self.exchange_request = ExchangeRequest.objects.create(user=user)
+
+    def set_swaps(self, dayly_swap, weekly_swap):
+        ExchangeRequest.objects.filter(id=self.exchange_request.id).update(
+            dayly_swap=dayly_swap, weekly_swap=weekly_swap
+        )
+
+    def assert_swaps(self, dayly_swap, weekly_swap):
+        self.exchange_request.refresh_from_db()
+        self.assertEqual(self.exchange_request.dayly_swap, dayly_swap)
+        self.assertEqual(self.exchange_request.weekly_swap, weekly_swap)
+
+    def test_amount_within_limits_is_reserved(self):
+        self.assertEqual(reserve_swap_limits(self.exchange_request.id, 1000), 1000)
+        self.assert_swaps(1000, 1000)
+
+        self.assertEqual(reserve_swap_limits(self.exchange_request.id, 500), 500)
+        self.assert_swaps(1500, 1500)
+
+    def test_partial_reservation_up_to_dayly_limit(self):
+        self.set_swaps(DAYLY_LIMIT - 100, DAYLY_LIMIT - 100)
+        self.assertEqual(reserve_swap_limits(self.exchange_request.id, 500), 100)
+        self.assert_swaps(DAYLY_LIMIT, DAYLY_LIMIT)
+
+    def test_partial_reservation_up_to_weekly_limit(self):
+        self.set_swaps(0, WEEKLY_LIMIT - 50)
+        self.assertEqual(reserve_swap_limits(self.exchange_request.id, 1000), 50)
+        self.assert_swaps(50, WEEKLY_LIMIT)
+
+    def test_nothing_is_reserved_when_dayly_limit_is_exhausted(self):
+        self.set_swaps(DAYLY_LIMIT, DAYLY_LIMIT)
+        self.assertEqual(reserve_swap_limits(self.exchange_request.id, 1000), 0)
+        self.assert_swaps(DAYLY_LIMIT, DAYLY_LIMIT)
+
+    def test_nothing_is_reserved_when_weekly_limit_is_exhausted(self):
+        self.set_swaps(0, WEEKLY_LIMIT)
+        self.assertEqual(reserve_swap_limits(self.exchange_request.id, 1000), 0)
+        self.assert_swaps(0, WEEKLY_LIMIT)
+
+    def test_sequential_reservations_stop_at_limit(self):
+        reserved = [reserve_swap_limits(self.exchange_request.id, DAYLY_LIMIT // 3 + 1) for _ in range(4)]
+        self.assertEqual(reserved, [DAYLY_LIMIT // 3 + 1] * 2 + [DAYLY_LIMIT - 2 * (DAYLY_LIMIT // 3 + 1), 0])
+        self.assert_swaps(DAYLY_LIMIT, DAYLY_LIMIT)
+
+    def test_unknown_exchange_request(self):
+        self.assertEqual(reserve_swap_limits(self.exchange_request.id + 1, 1000), 0)
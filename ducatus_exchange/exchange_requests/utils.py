@@ -1,9 +1,92 @@
-from ducatus_exchange.exchange_requests.models import ExchangeRequest
+from django.db import connection
+from django.utils import timezone
+
+from ducatus_exchange.consts import DAYLY_LIMIT, WEEKLY_LIMIT
+from ducatus_exchange.exchange_requests.models import ExchangeRequest, FundedAddress
+
+# sweep network which holds deposits of payment currency.
+# ERC20 token deposits are not indexed: there is no token sweep, and ETH sweep would drop them unswept
+SWEEP_NETWORKS = {
+    'ETH': 'ETH',
+    'DUCX': 'DUCX',
+    'BTC': 'BTC',
+}
+
+# deposit address field of exchange request for every sweep network
+SWEEP_ADDRESS_FIELDS = {
+    'ETH': 'eth_address',
+    'DUCX': 'ducx_address',
+    'BTC': 'btc_address',
+}
 
 
 def dayly_reset():
-    ExchangeRequest.objects.all().update(dayly_swap=0)
+    ExchangeRequest.objects.exclude(dayly_swap=0).update(dayly_swap=0)
 
 
 def weekly_reset():
-    ExchangeRequest.objects.all().update(weekly_swap=0)
+    ExchangeRequest.objects.exclude(weekly_swap=0).update(weekly_swap=0)
+
+
+def reserve_swap_limits(exchange_request_id, amount):
+    """
+    Atomically adds up to `amount` to daily and weekly swaps of exchange request
+
+    Reserved amount is limited by what is left of both limits, concurrent reservations wait for row lock
+    and see each other. Returns reserved amount, 0 when limits are exhausted
+    """
+    table = ExchangeRequest._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH reserve AS ('
+            f'SELECT id, LEAST(%s, %s - dayly_swap, %s - weekly_swap) AS amount '
+            f'FROM {table} WHERE id = %s FOR UPDATE'
+            f') '
+            f'UPDATE {table} SET dayly_swap = {table}.dayly_swap + reserve.amount, '
+            f'weekly_swap = {table}.weekly_swap + reserve.amount '
+            f'FROM reserve WHERE {table}.id = reserve.id AND reserve.amount > 0 '
+            f'RETURNING reserve.amount',
+            [amount, DAYLY_LIMIT, WEEKLY_LIMIT, exchange_request_id]
+        )
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def mark_address_funded(exchange_request_id, currency):
+    """ Adds deposit address of payment to funded index, address marked again is swept once """
+    network = SWEEP_NETWORKS.get(currency)
+    if network is None:
+        return
+
+    # funded_at is moved forward, so deposit arriving during sweep is not cleared by it
+    FundedAddress.objects.update_or_create(
+        exchange_request_id=exchange_request_id,
+        network=network,
+        defaults={'funded_at': timezone.now()},
+    )
+
+
+def get_funded_accounts(network):
+    """ Returns (address, user_id) of deposit addresses known to hold funds on network """
+    address_field = f'exchange_request__{SWEEP_ADDRESS_FIELDS[network]}'
+    return FundedAddress.objects.filter(network=network).exclude(**{address_field: None}) \
+        .order_by('id').values_list(address_field, 'exchange_request__user_id')
+
+
+def clear_funded_addresses(network, addresses, swept_from):
+    """
+    Removes swept addresses from funded index
+
+    Addresses funded again after sweep started at `swept_from` are kept for the next sweep
+    """
+    # eth and ducx addresses are stored lowercased, btc ones are case sensitive
+    addresses = set(address if network == 'BTC' else address.lower() for address in addresses)
+    if not addresses:
+        return 0
+    address_field = f'exchange_request__{SWEEP_ADDRESS_FIELDS[network]}__in'
+    deleted, _ = FundedAddress.objects.filter(
+        network=network,
+        funded_at__lte=swept_from,
+        **{address_field: addresses}
+    ).delete()
+    return deleted
@@ -0,0 +1,106 @@
+import time
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ducatus_exchange.settings import HTTP_CLIENT_TIMEOUT, HTTP_CLIENT_RETRIES, HTTP_CLIENT_BACKOFF, \
+    HTTP_CLIENT_POOL_SIZE
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(base_url, retries=HTTP_CLIENT_RETRIES):
+    """ One keep-alive session per host and retries count, shared by every client in the process """
+    key = (urlsplit(base_url).netloc, retries)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            retry = Retry(
+                total=retries,
+                backoff_factor=HTTP_CLIENT_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_CLIENT_POOL_SIZE,
+                pool_maxsize=HTTP_CLIENT_POOL_SIZE,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+        return session
+
+
+class EndpointStats:
+    """ Per-endpoint request counters, shared by every client in the process """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(lambda: {'count': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0})
+
+    def add(self, endpoint, elapsed, error=False):
+        with self.lock:
+            counter = self.counters[endpoint]
+            counter['count'] += 1
+            counter['errors'] += int(error)
+            counter['total_time'] += elapsed
+            counter['max_time'] = max(counter['max_time'], elapsed)
+
+    def report(self):
+        with self.lock:
+            return {
+                endpoint: dict(counter, avg_time=counter['total_time'] / counter['count'])
+                for endpoint, counter in self.counters.items()
+            }
+
+
+endpoint_stats = EndpointStats()
+
+
+class RateLimiter:
+    """ Allows not more than `rate` calls of wait() per second, shared between threads """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.lock = threading.Lock()
+        self.next_call = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class HttpClient:
+
+    def __init__(self, base_url, timeout=HTTP_CLIENT_TIMEOUT, retries=HTTP_CLIENT_RETRIES):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.session = get_session(base_url, retries)
+
+    def get(self, path, endpoint=None, **kwargs):
+        """
+        GET request to base_url + path with pooled connection, timeout and retries
+
+        `endpoint` is a label to collect latency under, for example '/tx/coins' instead of path with tx hash
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = f'{self.base_url}{endpoint or path}'
+        started = time.monotonic()
+        try:
+            res = self.session.get(f'{self.base_url}{path}', **kwargs)
+        except requests.exceptions.RequestException:
+            endpoint_stats.add(endpoint, time.monotonic() - started, error=True)
+            raise
+        endpoint_stats.add(endpoint, time.monotonic() - started, error=not res.ok)
+        return res
@@ -1,21 +1,125 @@
+import time
+import queue
+import socket
 import logging
-
+import threading
 from decimal import Decimal
-from http.client import RemoteDisconnected
+from functools import partial
+from http.client import RemoteDisconnected, HTTPException
 
 from bitcoinrpc.authproxy import AuthServiceProxy, JSONRPCException
 
-from ducatus_exchange.settings import NETWORK_SETTINGS
+from ducatus_exchange.settings import NETWORK_SETTINGS, DUC_RPC_POOL_SIZE, DUC_RPC_TIMEOUT, \
+    DUC_RPC_HEALTH_CHECK_INTERVAL
 from ducatus_exchange.consts import DECIMALS
+from ducatus_exchange.http_client import EndpointStats
 
 
 logger = logging.getLogger('litecoin_rpc')
 
+# node may have processed these before connection was lost, so they are not sent again
+NOT_RETRIED_METHODS = ('sendtoaddress', 'sendmany', 'sendrawtransaction')
+
+# latency and errors per rpc method
+rpc_stats = EndpointStats()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
 
 class DucatuscoreInterfaceException(Exception):
     pass
 
 
+class DucatuscoreRPCPool:
+    """
+    Process-wide pool of DUC node connections
+
+    Connections are created lazily up to DUC_RPC_POOL_SIZE, broken ones are replaced on RemoteDisconnected,
+    node health is checked by background thread instead of on every DucatuscoreInterface construction
+    """
+
+    def __init__(self, service_url, size=DUC_RPC_POOL_SIZE):
+        self.service_url = service_url
+        self.size = size
+        self.created = 0
+        self.lock = threading.Lock()
+        self.connections = queue.LifoQueue()
+        self.healthy = None
+        self.last_block = None
+        self.health_thread = threading.Thread(target=self.check_health_forever, daemon=True)
+        self.health_thread.start()
+
+    def connect(self):
+        return AuthServiceProxy(self.service_url, timeout=DUC_RPC_TIMEOUT)
+
+    def acquire(self):
+        try:
+            return self.connections.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                return self.connect()
+        return self.connections.get()
+
+    def release(self, connection):
+        self.connections.put(connection)
+
+    def call(self, method, *args):
+        for attempt in range(2):
+            connection = self.acquire()
+            started = time.monotonic()
+            try:
+                result = getattr(connection, method)(*args)
+            except (ConnectionError, HTTPException, socket.timeout) as e:
+                rpc_stats.add(method, time.monotonic() - started, error=True)
+                # connection is broken, it is replaced by new one which connects on first request
+                self.release(self.connect())
+                if attempt or method in NOT_RETRIED_METHODS or isinstance(e, socket.timeout):
+                    raise
+                logger.warning(msg=f'DUC node connection lost on {method}, reconnecting: {e!r}')
+                continue
+            except Exception:
+                rpc_stats.add(method, time.monotonic() - started, error=True)
+                self.release(connection)
+                raise
+            rpc_stats.add(method, time.monotonic() - started)
+            self.release(connection)
+            return result
+
+    def __getattr__(self, method):
+        if method.startswith('__'):
+            raise AttributeError(method)
+        return partial(self.call, method)
+
+    def check_health(self):
+        try:
+            self.last_block = self.call('getblockcount')
+            self.healthy = bool(self.last_block and self.last_block > 0)
+        except Exception as e:
+            self.healthy = False
+            logger.error(msg=f'DUC node health check failed: {e!r}')
+        return self.healthy
+
+    def check_health_forever(self):
+        while True:
+            self.check_health()
+            if not self.healthy:
+                logger.error(msg='Ducatus node not connected')
+            logger.info(msg=f'DUC node block {self.last_block}, rpc stats: {rpc_stats.report()}')
+            time.sleep(DUC_RPC_HEALTH_CHECK_INTERVAL)
+
+
+def get_rpc_pool(service_url):
+    with _pools_lock:
+        pool = _pools.get(service_url)
+        if pool is None:
+            pool = _pools[service_url] = DucatuscoreRPCPool(service_url)
+        return pool
+
+
 class DucatuscoreInterface:
     endpoint = None
     settings = None
@@ -24,8 +128,7 @@ class DucatuscoreInterface:
 
         self.settings = NETWORK_SETTINGS['DUC']
         self.setup_endpoint()
-        self.rpc = AuthServiceProxy(self.endpoint)
-        self.check_connection()
+        self.rpc = get_rpc_pool(self.endpoint)
 
     def setup_endpoint(self):
         self.endpoint = 'http://{user}:{pwd}@{host}:{port}'.format(
@@ -37,8 +140,7 @@ class DucatuscoreInterface:
         return
 
     def check_connection(self):
-        block = self.rpc.getblockcount()
-        if block and block > 0:
+        if self.rpc.check_health():
             return True
         else:
             raise Exception('Ducatus node not connected')
@@ -57,6 +159,20 @@ class DucatuscoreInterface:
             logger.error(msg=e)
             raise DucatuscoreInterfaceException(err)
 
+    def transfer_many(self, transfers):
+        try:
+            outputs = {address: Decimal(int(amount)) / DECIMALS['DUC'] for address, amount in transfers.items()}
+            logger.info(msg=f'try sending DUC to {len(outputs)} addresses: {outputs}')
+            self.rpc.walletpassphrase(self.settings['wallet_password'], 30)
+            res = self.rpc.sendmany('', outputs)
+            logger.info(msg=res)
+            return res
+        except JSONRPCException as e:
+            err = f'DUCATUS TRANSFER ERROR: batch transfer to {len(transfers)} addresses failed'
+            logger.error(msg=err)
+            logger.error(msg=e)
+            raise DucatuscoreInterfaceException(err)
+
     def validate_address(self, address):
         for attempt in range(10):
             logger.info(msg=f'attempt {attempt}')
@@ -1,19 +1,15 @@
-import sys
-import traceback
 import logging
 
 from django.utils import timezone
-from django.core.mail import get_connection, send_mail
 
-from ducatus_exchange.rates.models import UsdRate
+from ducatus_exchange.rates.api import get_rates_snapshot
 from ducatus_exchange.payments.models import Payment
 from ducatus_exchange.lottery.models import Lottery, LotteryPlayer
 from ducatus_exchange.transfers.models import DucatusTransfer
 from ducatus_exchange.consts import TICKETS_FOR_USD, DECIMALS, RATES_PRECISION, BONUSES_FOR_TICKETS
-from ducatus_exchange.email_messages import lottery_html_style, lottery_html_body, warning_html_style, \
-    warning_html_body, lottery_bonuses_html_body
-from ducatus_exchange.settings import CONFIRMATION_FROM_EMAIL, CONFIRMATION_FROM_PASSWORD, PROMO_START_TIMESTAMP, \
-    PROMO_END_TIMESTAMP, CONFIRMATION_HOST, EMAIL_PORT, EMAIL_USE_TLS
+from ducatus_exchange.mails.api import queue_mail, CONFIRMATION_ACCOUNT, LOTTERY_TEMPLATE, LOTTERY_BONUSES_TEMPLATE, \
+    WARNING_TEMPLATE
+from ducatus_exchange.settings import PROMO_START_TIMESTAMP, PROMO_END_TIMESTAMP
 
 
 logger = logging.getLogger(__name__)
@@ -103,11 +99,11 @@ class LotteryRegister:
         to_email = transfer.exchange_request.user.email
 
         if not lottery_player or not lottery_player.e_commerce_code and not lottery_player.back_office_code:
-            html_body = lottery_html_body.format(
+            html_message = LOTTERY_TEMPLATE.render(
                 tx_hash=transfer.tx_hash
             )
         else:
-            html_body = lottery_bonuses_html_body.format(
+            html_message = LOTTERY_BONUSES_TEMPLATE.render(
                 tx_hash=lottery_player.transfer.tx_hash,
                 tickets_amount=lottery_player.tickets_amount,
                 back_office_bonus=BONUSES_FOR_TICKETS[lottery_player.tickets_amount]['back_office_bonus'],
@@ -116,70 +112,29 @@ class LotteryRegister:
                 e_commerce_code=lottery_player.e_commerce_code,
             )
 
-        connection = cls.get_mail_connection()
-        try:
-            send_mail(
-                f'Your DUC Purchase Confirmation for ${round(usd_amount, 2)}',
-                '',
-                CONFIRMATION_FROM_EMAIL,
-                [to_email],
-                connection=connection,
-                html_message=lottery_html_style + html_body,
-            )
-
-            logger.info(msg=(f'conformation message sent successfully to {to_email}'))
-        except Exception as e:
-            logger.error(msg=('\n'.join(traceback.format_exception(*sys.exc_info()))))
+        queue_mail(
+            CONFIRMATION_ACCOUNT,
+            to_email,
+            f'Your DUC Purchase Confirmation for ${round(usd_amount, 2)}',
+            html_message,
+        )
+        logger.info(msg=(f'conformation message queued to {to_email}'))
 
     @classmethod
     def send_warning_mail(cls, usd_amount, payment: Payment):
-        connection = cls.get_mail_connection()
-
-        html_body = warning_html_body.format(
+        html_message = WARNING_TEMPLATE.render(
             duc_amount=round(payment.sent_amount / DECIMALS['DUC'], 5)
         )
         to_email = payment.exchange_request.user.email
 
-        try:
-            send_mail(
-                f'Your DUC Purchase Confirmation for ${round(usd_amount, 2)}',
-                '',
-                CONFIRMATION_FROM_EMAIL,
-                [to_email],
-                connection=connection,
-                html_message=warning_html_style + html_body,
-            )
-            logger.info(msg=(f'warning message sent successfully to {to_email}'))
-        except Exception as e:
-            logger.error(msg=('\n'.join(traceback.format_exception(*sys.exc_info()))))
-
-    @staticmethod
-    def get_mail_connection():
-        connection = get_connection(
-            host=CONFIRMATION_HOST,
-            port=EMAIL_PORT,
-            username=CONFIRMATION_FROM_EMAIL,
-            password=CONFIRMATION_FROM_PASSWORD,
-            use_tls=EMAIL_USE_TLS,
+        queue_mail(
+            CONFIRMATION_ACCOUNT,
+            to_email,
+            f'Your DUC Purchase Confirmation for ${round(usd_amount, 2)}',
+            html_message,
         )
-        return connection
+        logger.info(msg=(f'warning message queued to {to_email}'))
 
     @staticmethod
     def get_usd_prices():
-        # TODO merge this with same from quantum.views; rates.serializers
-        usd_prices = {}
-        rate = UsdRate.objects.first()
-        usd_prices['ETH'] = rate.eth_price
-        usd_prices['BTC'] = rate.btc_price
-        usd_prices['USDC'] = rate.usdc_price
-        usd_prices['DUC'] = rate.duc_price
-        usd_prices['DUCX'] = rate.ducx_price
-
-        usd_prices['USD'] = rate.usd_price
-        usd_prices['EUR'] = rate.eur_price
-        usd_prices['GBP'] = rate.gbp_price
-        usd_prices['CHF'] = rate.chf_price
-
-        logger.info(msg=('current rates', usd_prices))
-
-        return usd_prices
+        return dict(get_rates_snapshot().usd_prices)
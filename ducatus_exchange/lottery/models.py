@@ -1,20 +1,17 @@
-import sys
 import random
 import string
-import traceback
+import logging
 
 from django.db import models
 from django.contrib.postgres.fields import JSONField
 from django.contrib.postgres.fields import ArrayField
-from django.core.mail import get_connection, send_mail
 
 from ducatus_exchange.exchange_requests.models import DucatusUser
 from ducatus_exchange.transfers.models import DucatusTransfer
 from ducatus_exchange.consts import MAX_DIGITS
-from ducatus_exchange.settings import (PROMO_CODES_LEN, WINNERS_CONGRATULATIONS_HOST, EMAIL_PORT,
-                                       WINNERS_CONGRATULATIONS_FROM_EMAIL, WINNERS_CONGRATULATIONS_FROM_PASSWORD,
-                                       EMAIL_USE_TLS)
-from ducatus_exchange.email_messages import congratulations_html_style, congratulations_html_body
+from ducatus_exchange.settings import PROMO_CODES_LEN
+
+logger = logging.getLogger(__name__)
 
 
 class Lottery(models.Model):
@@ -32,37 +29,21 @@ class Lottery(models.Model):
     winner_players_ids = ArrayField(models.IntegerField())
 
     def send_mails_to_winners(self):
+        from ducatus_exchange.mails.api import queue_mail, WINNERS_ACCOUNT, CONGRATULATIONS_TEMPLATE
+
         # temporarily hardcode
         prizes = ['80% of achieved DUC sales', '68K of DUC', 'Denarius bank account']
 
+        winners = LotteryPlayer.objects.in_bulk(self.winner_players_ids)
         for i, winner_id in enumerate(self.winner_players_ids):
-            winner = LotteryPlayer.objects.get(id=winner_id)
-            connection = self.get_mail_connection()
-
-            html_body = congratulations_html_style + congratulations_html_body.format(prize=prizes[i])
-            try:
-                send_mail(
-                    'You’re a winner!',
-                    '',
-                    WINNERS_CONGRATULATIONS_FROM_EMAIL,
-                    [winner.email],
-                    connection=connection,
-                    html_message=html_body,
-                )
-                print(f'CONGRATULATIONS message sent successfully to {winner.email}')
-            except Exception as e:
-                print('\n'.join(traceback.format_exception(*sys.exc_info())), flush=True)
-
-    @staticmethod
-    def get_mail_connection():
-        connection = get_connection(
-            host=WINNERS_CONGRATULATIONS_HOST,
-            port=EMAIL_PORT,
-            username=WINNERS_CONGRATULATIONS_FROM_EMAIL,
-            password=WINNERS_CONGRATULATIONS_FROM_PASSWORD,
-            use_tls=EMAIL_USE_TLS,
-        )
-        return connection
+            winner = winners[winner_id]
+            queue_mail(
+                WINNERS_ACCOUNT,
+                winner.email,
+                'You’re a winner!',
+                CONGRATULATIONS_TEMPLATE.render(prize=prizes[i]),
+            )
+            logger.info(msg=f'CONGRATULATIONS message queued to {winner.email}')
 
 
 class LotteryPlayer(models.Model):
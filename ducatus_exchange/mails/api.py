@@ -0,0 +1,158 @@
+import logging
+import threading
+from datetime import timedelta
+from smtplib import SMTPServerDisconnected
+from string import Formatter
+
+from django.core.mail import get_connection, EmailMultiAlternatives
+from django.db import transaction
+from django.utils import timezone
+
+from ducatus_exchange.mails.models import Mail
+from ducatus_exchange.email_messages import lottery_html_style, lottery_html_body, lottery_bonuses_html_body, \
+    warning_html_style, warning_html_body, voucher_html_body, congratulations_html_style, congratulations_html_body
+from ducatus_exchange.settings import CONFIRMATION_HOST, CONFIRMATION_FROM_EMAIL, CONFIRMATION_FROM_PASSWORD, \
+    WINNERS_CONGRATULATIONS_HOST, WINNERS_CONGRATULATIONS_FROM_EMAIL, WINNERS_CONGRATULATIONS_FROM_PASSWORD, \
+    EMAIL_PORT, EMAIL_USE_TLS, MAIL_BATCH_SIZE, MAIL_MAX_ATTEMPTS, MAIL_RETRY_BACKOFF, MAIL_CLAIM_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+CONFIRMATION_ACCOUNT = 'confirmation'
+WINNERS_ACCOUNT = 'winners'
+
+MAIL_ACCOUNTS = {
+    CONFIRMATION_ACCOUNT: {
+        'host': CONFIRMATION_HOST,
+        'username': CONFIRMATION_FROM_EMAIL,
+        'password': CONFIRMATION_FROM_PASSWORD,
+    },
+    WINNERS_ACCOUNT: {
+        'host': WINNERS_CONGRATULATIONS_HOST,
+        'username': WINNERS_CONGRATULATIONS_FROM_EMAIL,
+        'password': WINNERS_CONGRATULATIONS_FROM_PASSWORD,
+    },
+}
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+class MailTemplate:
+    """
+    HTML email template, style is prepended and body placeholders are parsed once on creation
+
+    Only plain `{name}` placeholders are supported, as used in email_messages
+    """
+
+    def __init__(self, style, body):
+        self.parts = []
+        literal = style
+        for text, field_name, _, _ in Formatter().parse(body):
+            literal += text
+            if field_name is not None:
+                self.parts.append((literal, field_name))
+                literal = ''
+        self.tail = literal
+
+    def render(self, **kwargs):
+        return ''.join(f'{literal}{kwargs[field_name]}' for literal, field_name in self.parts) + self.tail
+
+
+LOTTERY_TEMPLATE = MailTemplate(lottery_html_style, lottery_html_body)
+LOTTERY_BONUSES_TEMPLATE = MailTemplate(lottery_html_style, lottery_bonuses_html_body)
+WARNING_TEMPLATE = MailTemplate(warning_html_style, warning_html_body)
+VOUCHER_TEMPLATE = MailTemplate(warning_html_style, voucher_html_body)
+CONGRATULATIONS_TEMPLATE = MailTemplate(congratulations_html_style, congratulations_html_body)
+
+
+def queue_mail(account, to_email, subject, html_message):
+    """ Stores mail in queue, it is sent by worker after current transaction is committed """
+    from ducatus_exchange.mails.tasks import send_queued_mails
+
+    mail = Mail.objects.create(account=account, to_email=to_email, subject=subject, html_message=html_message)
+    transaction.on_commit(send_queued_mails.delay)
+    return mail
+
+
+def get_mail_connection(account):
+    """ Opened SMTP connection of sender account, kept open between sends in this process """
+    with _connections_lock:
+        connection = _connections.get(account)
+        if connection is None:
+            settings = MAIL_ACCOUNTS[account]
+            connection = get_connection(
+                host=settings['host'],
+                port=EMAIL_PORT,
+                username=settings['username'],
+                password=settings['password'],
+                use_tls=EMAIL_USE_TLS,
+            )
+            _connections[account] = connection
+    connection.open()
+    return connection
+
+
+def close_mail_connection(account):
+    with _connections_lock:
+        connection = _connections.pop(account, None)
+    if connection is not None:
+        connection.close()
+
+
+def claim_mails(limit):
+    """ Takes due mails for MAIL_CLAIM_TIMEOUT seconds, so they are not sent by another worker meanwhile """
+    now = timezone.now()
+    with transaction.atomic():
+        mails = list(
+            Mail.objects.select_for_update(skip_locked=True)
+            .filter(state='QUEUED', next_attempt_at__lte=now)
+            .order_by('account', 'id')[:limit]
+        )
+        Mail.objects.filter(id__in=[mail.id for mail in mails]) \
+            .update(next_attempt_at=now + timedelta(seconds=MAIL_CLAIM_TIMEOUT))
+    return mails
+
+
+def send_message(account, message):
+    try:
+        get_mail_connection(account).send_messages([message])
+    except SMTPServerDisconnected:
+        # pooled connection was closed by server, reconnect once
+        close_mail_connection(account)
+        get_mail_connection(account).send_messages([message])
+
+
+def send_queued_mails(limit=MAIL_BATCH_SIZE):
+    """
+    Sends a batch of queued mails over pooled connections of their sender accounts
+
+    Failed mails are retried with exponential backoff and marked FAILED after MAIL_MAX_ATTEMPTS.
+    Returns number of sent mails
+    """
+    sent = 0
+    for mail in claim_mails(limit):
+        message = EmailMultiAlternatives(
+            mail.subject, '', MAIL_ACCOUNTS[mail.account]['username'], [mail.to_email],
+        )
+        message.attach_alternative(mail.html_message, 'text/html')
+        mail.attempts += 1
+        try:
+            send_message(mail.account, message)
+        except Exception as e:
+            close_mail_connection(mail.account)
+            mail.last_error = str(e)
+            if mail.attempts >= MAIL_MAX_ATTEMPTS:
+                mail.state = 'FAILED'
+                logger.error(msg=f'mail {mail.id} to {mail.to_email} failed after {mail.attempts} attempts: {e}')
+            else:
+                mail.next_attempt_at = timezone.now() + timedelta(
+                    seconds=MAIL_RETRY_BACKOFF * 2 ** (mail.attempts - 1)
+                )
+                logger.warning(msg=f'mail {mail.id} to {mail.to_email} not sent, retry at {mail.next_attempt_at}: {e}')
+        else:
+            mail.state = 'SENT'
+            mail.sent_date = timezone.now()
+            sent += 1
+            logger.info(msg=f'mail {mail.id} "{mail.subject}" sent successfully to {mail.to_email}')
+        mail.save()
+    return sent
@@ -0,0 +1,25 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Mail(models.Model):
+    """ Outbound email queue, mails are sent by mails.tasks.send_queued_mails with pooled SMTP connections """
+
+    STATES_DEFAULT = ('QUEUED', 'SENT', 'FAILED')
+    STATES = list(zip(STATES_DEFAULT, STATES_DEFAULT))
+
+    account = models.CharField(max_length=50)
+    to_email = models.CharField(max_length=254)
+    subject = models.CharField(max_length=255)
+    html_message = models.TextField()
+    state = models.CharField(max_length=10, choices=STATES, default=STATES_DEFAULT[0])
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(null=True, default=None)
+    created_date = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_date = models.DateTimeField(null=True, default=None)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'next_attempt_at']),
+        ]
@@ -0,0 +1,7 @@
+from ducatus_exchange.mails.api import send_queued_mails as send_mails
+from celery_config import app
+
+
+@app.task
+def send_queued_mails():
+    send_mails()
@@ -1,12 +1,14 @@
-import json
-import requests
 import logging
+import threading
+
+import requests
 
 from eth_utils import to_checksum_address
 from eth_account import Account
 from web3 import Web3
 
-from ducatus_exchange.settings import NETWORK_SETTINGS, DUCX_GAS_PRICE, DUCX_TRANSFER_GAS_LIMIT
+from ducatus_exchange.settings import NETWORK_SETTINGS, DUCX_GAS_PRICE, DUCX_TRANSFER_GAS_LIMIT, PARITY_RPC_TIMEOUT
+from ducatus_exchange.http_client import get_session
 from ducatus_exchange.consts import DECIMALS
 
 logger = logging.getLogger('parity_interface')
@@ -24,53 +26,129 @@ class ParConnectExc(Exception):
         return self.value
 
 
+class ParTimeoutExc(ParConnectExc):
+    def __init__(self, *args):
+        self.value = 'parity request timed out'
+
+
 class ParErrorExc(Exception):
-    pass
+    def __init__(self, message, code=None, data=None):
+        super().__init__(message)
+        self.code = code
+        self.data = data
+
+
+_chain_ids = {}
+_chain_ids_lock = threading.Lock()
+
 
-    
 class ParityInterface:
+    """
+    JSON-RPC client of DUCX node
+
+    Requests go through keep-alive session shared by the process, chainId is requested once per process
+    """
 
     endpoint = None
     settings = None
 
-    def __init__(self):
+    def __init__(self, endpoint=None):
 
         self.settings = NETWORK_SETTINGS['DUCX']
-        self.setup_endpoint()
+        self.setup_endpoint(endpoint)
         # self.check_connection()
 
-    def setup_endpoint(self):
-        self.endpoint = '{schema}://{host}:{port}'.format(
+    def setup_endpoint(self, endpoint=None):
+        """ Endpoint of DUCX node from settings, `endpoint` is used for another node, e.g. ETH one """
+        self.endpoint = endpoint or '{schema}://{host}:{port}'.format(
             host=self.settings['host'],
             port=self.settings['port'],
             schema=self.settings['schema']
         )
-        self.settings['chainId'] = self.eth_chainId()
-        logger.info(msg=f'parity interface {self.settings}')
+        self.session = get_session(self.endpoint)
         return
 
+    @property
+    def chain_id(self):
+        with _chain_ids_lock:
+            if self.endpoint not in _chain_ids:
+                _chain_ids[self.endpoint] = int(self.eth_chainId(), 16)
+                logger.info(msg=f'parity interface {self.endpoint}, chainId {_chain_ids[self.endpoint]}')
+            return _chain_ids[self.endpoint]
+
+    def post(self, payload):
+        try:
+            response = self.session.post(self.endpoint, json=payload, timeout=PARITY_RPC_TIMEOUT)
+        except requests.exceptions.Timeout:
+            raise ParTimeoutExc()
+        except requests.exceptions.ConnectionError:
+            raise ParConnectExc()
+        try:
+            return response.json()
+        except ValueError:
+            raise ParErrorExc(f'invalid response from parity, status {response.status_code}', response.status_code)
+
+    @staticmethod
+    def get_result(result):
+        if result.get('error'):
+            error = result['error']
+            raise ParErrorExc(error.get('message'), error.get('code'), error.get('data'))
+        return result['result']
+
     def __getattr__(self, method):
+        if method.startswith('__'):
+            raise AttributeError(method)
+
         def f(*args):
-            arguments = { 
+            arguments = {
                     'method': method,
                     'params': args,
                     'id': 1,
                     'jsonrpc': '2.0',
             }
-            try:
-                temp = requests.post(
-                    self.endpoint,
-                    json=arguments,
-                    headers={'Content-Type': 'application/json'}
-                )
-            except requests.exceptions.ConnectionError as e:
-                raise ParConnectExc()
-            result = json.loads(temp.content.decode())
-            if result.get('error'):
-                raise ParErrorExc(result['error']['message'])
-            return result['result']
+            return self.get_result(self.post(arguments))
         return f
 
+    def batch(self, *calls):
+        """
+        Sends several calls in one JSON-RPC batch request
+
+        Every call is a tuple of method name and its params, results are returned in the same order
+        """
+        payload = [
+            {'method': method, 'params': params, 'id': i, 'jsonrpc': '2.0'}
+            for i, (method, *params) in enumerate(calls)
+        ]
+        results = self.post(payload)
+        if not isinstance(results, list):
+            # node answers with single error object when batch itself is invalid
+            return [self.get_result(results)]
+        results = {result['id']: result for result in results}
+        return [self.get_result(results[i]) for i in range(len(calls))]
+
+    def get_account_state(self, address):
+        """ Pending nonce, gas price and balance of address with one request """
+        address = Web3.toChecksumAddress(address)
+        nonce, gas_price, balance = self.batch(
+            ('eth_getTransactionCount', address, 'pending'),
+            ('eth_gasPrice',),
+            ('eth_getBalance', address, 'latest'),
+        )
+        return {'nonce': int(nonce, 16), 'gas_price': int(gas_price, 16), 'balance': int(balance, 16)}
+
+    def sign_transfer(self, address, amount, nonce, gas_price, from_private):
+        tx_params = {
+            'to': to_checksum_address(address),
+            'value': int(amount),
+            'gas': DUCX_TRANSFER_GAS_LIMIT,
+            'gasPrice': int(gas_price),
+            'nonce': int(nonce),
+            'chainId': self.chain_id
+        }
+        logger.info(msg=f'TX PARAMS {tx_params}')
+
+        return Account.sign_transaction(tx_params, from_private)
+
     def transfer(self, address, amount, from_address=None, from_private=None):
         if not from_address:
             from_address = self.settings['address']
@@ -82,21 +160,10 @@ class ParityInterface:
             amount=amount / DECIMALS['DUCX']
         ))
 
-        nonce = self.eth_getTransactionCount(from_address, "pending")
-        gas_price = self.eth_gasPrice()
-        chain_id = self.settings['chainId']
-
-        tx_params = {
-            'to': to_checksum_address(address),
-            'value': int(amount),
-            'gas': DUCX_TRANSFER_GAS_LIMIT,
-            'gasPrice': DUCX_GAS_PRICE,
-            'nonce': int(nonce, 16),
-            'chainId': int(chain_id, 16)
-        }
-        logger.info(msg=f'TX PARAMS {tx_params}')
+        account_state = self.get_account_state(from_address)
+        logger.info(msg=f'sender state {account_state}')
 
-        signed = Account.sign_transaction(tx_params, from_private)
+        signed = self.sign_transfer(address, amount, account_state['nonce'], DUCX_GAS_PRICE, from_private)
 
         try:
             sent = self.eth_sendRawTransaction(signed.rawTransaction.hex())
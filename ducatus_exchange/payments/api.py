@@ -5,11 +5,12 @@ import random
 import string
 import time
 import json
+from datetime import timedelta
 from sys import platform
 
 import requests
-from django.core.mail import send_mail
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
 from django.utils import timezone
 from web3 import Web3, HTTPProvider
 
@@ -20,25 +21,25 @@ from ducatus_exchange.consts import DECIMALS
 from ducatus_exchange.parity_interface import ParityInterfaceException
 from ducatus_exchange import payments, settings_local
 from ducatus_exchange.consts import DAYLY_LIMIT, DECIMALS, WEEKLY_LIMIT
-from ducatus_exchange.email_messages import (
-    voucher_html_body,
-    warning_html_style
-)
 from ducatus_exchange.exchange_requests.models import (
     ExchangeRequest,
     ExchangeStatus
 )
+from ducatus_exchange.exchange_requests.utils import mark_address_funded
 from ducatus_exchange.litecoin_rpc import DucatuscoreInterfaceException
-from ducatus_exchange.lottery.api import LotteryRegister
+from ducatus_exchange.mails.api import queue_mail, CONFIRMATION_ACCOUNT, VOUCHER_TEMPLATE
 from ducatus_exchange.parity_interface import (
     ParityInterface,
     ParityInterfaceException
 )
-from ducatus_exchange.payments.models import Payment
+from ducatus_exchange.payments.models import Payment, PaymentTransition
 from ducatus_exchange.payments.utils import calculate_amount
 from ducatus_exchange.rates.serializers import get_usd_prices
-from ducatus_exchange.settings import MINIMAL_RETURN
-from ducatus_exchange.settings_local import CONFIRMATION_FROM_EMAIL, NETWORK_SETTINGS, WALLET_API_URL, ERC20_ABI
+from ducatus_exchange.rates.api import get_rates_snapshot, get_rates_at
+from ducatus_exchange.settings import MINIMAL_RETURN, PAYMENT_OUTBOX_BATCH_SIZE, PAYMENT_OUTBOX_CLAIM_TIMEOUT, \
+    PAYMENT_OUTBOX_MAX_ATTEMPTS
+from ducatus_exchange.bot.services import send_or_update_messages
+from ducatus_exchange.settings_local import NETWORK_SETTINGS, WALLET_API_URL, ERC20_ABI
 from ducatus_exchange.transfers.api import check_limits, save_transfer, make_ref_transfer, transfer_ducatusx
 from ducatus_exchange.transfers.api import save_transfer, TransferException
 from web3 import Web3, HTTPProvider
@@ -47,15 +48,22 @@ from web3.exceptions import TransactionNotFound
 logger = logging.getLogger(__name__)
 
 
-def register_payment(request_id, tx_hash, currency, amount, from_address):
+def register_payment(request_id, tx_hash, currency, amount, from_address, output_index=0, rate_time=None):
+    """
+    Registers payment priced with current rates or with rates at `rate_time` when it is given
+
+    Returns None if payment for this transaction output is already registered
+    """
     exchange_request = ExchangeRequest.objects.get(id=request_id)
 
-    calculated_amount, rate = calculate_amount(amount, currency)
+    snapshot = get_rates_at(rate_time) if rate_time else get_rates_snapshot()
+    calculated_amount, rate = calculate_amount(amount, currency, snapshot)
     logger.info(msg=f'amount:{calculated_amount} rate: {rate}')
     payment = Payment(
         exchange_request=exchange_request,
         tx_hash=tx_hash,
         currency=currency,
+        output_index=output_index,
         original_amount=amount,
         rate=rate,
         sent_amount=calculated_amount,
@@ -66,7 +74,12 @@ def register_payment(request_id, tx_hash, currency, amount, from_address):
         f' on rate {rate} within request {exchange_request.id} with TXID: {tx_hash}')
     )
 
-    payment.save()
+    try:
+        with transaction.atomic():
+            payment.save()
+    except IntegrityError:
+        logger.info(msg=f'tx {tx_hash} ({currency}, output {output_index}) already registered')
+        return None
     logger.info(msg='payment ok')
 
     return payment
@@ -74,13 +87,17 @@ def register_payment(request_id, tx_hash, currency, amount, from_address):
 
 def parse_payment_message(message):
     tx = message.get('transactionHash')
-    if not Payment.objects.filter(tx_hash=tx).count() > 0:
+    currency = message.get('currency')
+    output_index = message.get('outputIndex', 0)
+    if not Payment.objects.filter(tx_hash=tx, currency=currency, output_index=output_index).exists():
         request_id = message.get('exchangeId')
         amount = message.get('amount')
-        currency = message.get('currency')
         from_address = message.get('fromAddress', None)
         logger.info(msg=('PAYMENT:', tx, request_id, amount, currency))
-        payment = register_payment(request_id, tx, currency, amount, from_address)
+        payment = register_payment(request_id, tx, currency, amount, from_address, output_index)
+        if payment is None:
+            return
+        mark_address_funded(payment.exchange_request_id, currency)
         user = payment.exchange_request.user
         if user.platform == 'DUCX' and not user.address.startswith('voucher'):
             transfer_ducatusx(payment)
@@ -125,21 +142,17 @@ def create_voucher(usd_amount, charge_id=None, payment_id=None):
 
 
 def send_voucher_email(voucher, to_email, usd_amount):
-    conn = LotteryRegister.get_mail_connection()
-
-    html_body = voucher_html_body.format(
+    html_message = VOUCHER_TEMPLATE.render(
         voucher_code=voucher['activation_code']
     )
 
-    send_mail(
+    queue_mail(
+        CONFIRMATION_ACCOUNT,
+        to_email,
         f'Your DUC Purchase Confirmation for ${round(usd_amount, 2)}',
-        '',
-        CONFIRMATION_FROM_EMAIL,
-        [to_email],
-        connection=conn,
-        html_message=warning_html_style + html_body,
+        html_message,
     )
-    logger.info(msg=f'voucher message sent successfully to {to_email}')
+    logger.info(msg=f'voucher message queued to {to_email}')
 
 
 def process_vaucher(payment):
@@ -156,6 +169,7 @@ def process_vaucher(payment):
         if user.ref_address:
             logger.info(msg=f'payment with id: {payment.id} added to queue to send.')
             payment.state_transfer_queued()
+            payment.save()
     except DucatuscoreInterfaceException as e:
         payment.state_transfer_error()
         payment.save()
@@ -207,7 +221,8 @@ def get_payments_statistics():
 
 
 def parse_payment_manually(tx_hash, currency):
-    address_field_name = currency.lower() + '_address__iexact'
+    # DUC and BTC addresses are case sensitive and stored as generated, so exact match uses plain index
+    address_field_name = currency.lower() + '_address'
     if currency in ['DUC', 'BTC']:
         base_url = NETWORK_SETTINGS[currency].get('bitcore_url')
         if not base_url:
@@ -226,7 +241,7 @@ def parse_payment_manually(tx_hash, currency):
         except (KeyError, IndexError):
             from_address = None
 
-        for output in data['outputs']:
+        for output_index, output in enumerate(data['outputs']):
             try:
                 exchange_request = ExchangeRequest.objects.get(**{ address_field_name: output['address'] })
             except ExchangeRequest.DoesNotExist:
@@ -237,6 +252,8 @@ def parse_payment_manually(tx_hash, currency):
                     'fromAddress': from_address,
                     'address': output['address'],
                     'transactionHash': tx_hash,
+                    # bitcore lists outputs in vout order and also returns the vout as mintIndex
+                    'outputIndex': output.get('mintIndex', output_index),
                     'currency': currency,
                     'amount': output['value'],
                     'success': True,
@@ -266,7 +283,7 @@ def parse_payment_manually(tx_hash, currency):
 
         event = receipt[0].args
         try:
-            exchange_request = ExchangeRequest.objects.get(eth_address__iexact=event.to)
+            exchange_request = ExchangeRequest.objects.get(eth_address=event.to.lower())
         except ExchangeRequest.DoesNotExist:
             raise ValueError(f'Exchange request not found')
 
@@ -291,7 +308,8 @@ def parse_payment_manually(tx_hash, currency):
             raise ValueError(f'Transaction {tx_hash} failed')
 
         try:
-            exchange_request = ExchangeRequest.objects.get(**{ address_field_name: receipt.to })
+            # web3 returns checksummed address, ducx and eth addresses are stored lowercased
+            exchange_request = ExchangeRequest.objects.get(**{ address_field_name: receipt.to.lower() })
         except ExchangeRequest.DoesNotExist:
             raise ValueError(f'Exchange request not found')
 
@@ -308,3 +326,53 @@ def parse_payment_manually(tx_hash, currency):
         parse_payment_message(message)
     else:
         raise ValueError(f'Invalid currency: {currency}')
+
+
+def claim_payment_transitions(limit):
+    """
+    Claims undelivered transitions for PAYMENT_OUTBOX_CLAIM_TIMEOUT seconds in a short transaction
+
+    Payments with transitions claimed by another worker are skipped, so one payment is sent by one worker at a time
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        busy_payments = PaymentTransition.objects.filter(claimed_until__gt=now).values('payment_id')
+        transitions = list(
+            PaymentTransition.objects.select_for_update(skip_locked=True)
+            .filter(Q(claimed_until=None) | Q(claimed_until__lte=now))
+            .exclude(payment_id__in=busy_payments)
+            .order_by('id')[:limit]
+        )
+        PaymentTransition.objects.filter(id__in=[transition.id for transition in transitions]) \
+            .update(claimed_until=now + timedelta(seconds=PAYMENT_OUTBOX_CLAIM_TIMEOUT))
+    return transitions
+
+
+def deliver_payment_transitions(limit=PAYMENT_OUTBOX_BATCH_SIZE):
+    """
+    Notifies Telegram subscribers about payments from transitions outbox
+
+    Rapid transitions of one payment are coalesced into one update with its current state.
+    Transitions of payments which failed to be delivered stay claimed and are retried after claim timeout,
+    they are dropped after PAYMENT_OUTBOX_MAX_ATTEMPTS attempts. Returns number of delivered transitions
+    """
+    transitions = claim_payment_transitions(limit)
+    if not transitions:
+        return 0
+
+    payment_ids = list(dict.fromkeys(transition.payment_id for transition in transitions))
+    payments = Payment.objects.in_bulk(payment_ids)
+    delivered_payments = send_or_update_messages(
+        [payments[payment_id] for payment_id in payment_ids if payment_id in payments]
+    )
+
+    delivered = [transition.id for transition in transitions if transition.payment_id in delivered_payments]
+    failed = [transition.id for transition in transitions if transition.payment_id not in delivered_payments]
+    PaymentTransition.objects.filter(id__in=delivered).delete()
+    PaymentTransition.objects.filter(id__in=failed).update(attempts=F('attempts') + 1)
+    exhausted = PaymentTransition.objects.filter(id__in=failed, attempts__gte=PAYMENT_OUTBOX_MAX_ATTEMPTS)
+    for payment_id, transfer_state in exhausted.values_list('payment_id', 'transfer_state'):
+        logger.error(msg=f'payment {payment_id} transition to {transfer_state} was not delivered '
+                         f'in {PAYMENT_OUTBOX_MAX_ATTEMPTS} attempts, dropping it')
+    exhausted.delete()
+    return len(delivered)
@@ -0,0 +1,109 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ducatus_exchange.exchange_requests.models import DucatusUser, ExchangeRequest
+from ducatus_exchange.payments.models import Payment
+
+
+class Rollback(Exception):
+    pass
+
+
+def get_hot_queries():
+    """ Querysets of hot payment and exchange request lookups, labeled by where they are used """
+    week_ago = timezone.now() - timedelta(days=7)
+    return [
+        ('process_queued_duc_transfer: queued payments',
+         Payment.objects.filter(transfer_state='QUEUED').order_by('id')[:200]),
+        ('process_queued_duc_transfer: pending payment',
+         Payment.objects.filter(transfer_state='PENDING')[:1]),
+        ('get_payments_statistics: not collected payments',
+         Payment.objects.filter(collection_state='NOT_COLLECTED', currency='ETH')),
+        ('DucToDucxSwap: payments since time',
+         Payment.objects.filter(currency='DUC', created_date__gt=week_ago)),
+        ('parse_payment_message: payment by tx',
+         Payment.objects.filter(tx_hash='0xhash_1', currency='ETH', output_index=0)),
+        ('get_or_create_ducatus_user_and_exchange_request: user by address and platform',
+         DucatusUser.objects.filter(address='user_address_1', platform='DUC')),
+        ('CheckLimitView: user by address',
+         DucatusUser.objects.filter(address='user_address_1')),
+        ('parse_payment_manually: exchange request by duc address',
+         ExchangeRequest.objects.filter(duc_address='duc_address_1')),
+        ('parse_payment_manually: exchange request by btc address',
+         ExchangeRequest.objects.filter(btc_address='btc_address_1')),
+        ('parse_payment_manually: exchange request by eth address',
+         ExchangeRequest.objects.filter(eth_address='eth_address_1')),
+        ('DucxTransactionScheduler: exchange request by ducx address',
+         ExchangeRequest.objects.filter(ducx_address='ducx_address_1')),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on hot Payment and ExchangeRequest queries and flags sequential scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=50000,
+                            help='number of fake users and payments created for the audit and rolled back after it '
+                                 '(0 to explain on existing data)')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed']:
+                    self.seed(options['seed'])
+                seq_scans = self.explain_all()
+                raise Rollback()
+        except Rollback:
+            pass
+
+        if seq_scans:
+            self.stdout.write(self.style.ERROR(f'{len(seq_scans)} queries use sequential scan: {seq_scans}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('all hot queries use indexes'))
+
+    def seed(self, count):
+        """ Creates users, exchange requests and payments with production-like state distribution """
+        self.stdout.write(f'seeding {count} users and payments')
+        users = DucatusUser.objects.bulk_create(
+            DucatusUser(address=f'user_address_{i}', platform=random.choice(['DUC', 'DUCX'])) for i in range(count)
+        )
+        exchange_requests = ExchangeRequest.objects.bulk_create(
+            ExchangeRequest(
+                user=user,
+                duc_address=f'duc_address_{i}',
+                ducx_address=f'ducx_address_{i}',
+                btc_address=f'btc_address_{i}',
+                eth_address=f'eth_address_{i}',
+            ) for i, user in enumerate(users)
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                exchange_request=exchange_request,
+                tx_hash=f'0xhash_{i}',
+                currency=random.choice(['ETH', 'BTC', 'USDC', 'DUC', 'DUCX']),
+                original_amount=1,
+                rate=1,
+                sent_amount=1,
+                transfer_state=random.choices(['DONE', 'QUEUED', 'PENDING', 'RETURNED'], [96, 2, 1, 1])[0],
+                collection_state=random.choices(['COLLECTED', 'NOT_COLLECTED'], [95, 5])[0],
+            ) for i, exchange_request in enumerate(exchange_requests)
+        )
+        with connection.cursor() as cursor:
+            for model in (DucatusUser, ExchangeRequest, Payment):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+    def explain_all(self):
+        seq_scans = []
+        for label, queryset in get_hot_queries():
+            plan = queryset.explain()
+            uses_seq_scan = 'Seq Scan' in plan
+            style = self.style.WARNING if uses_seq_scan else self.style.SUCCESS
+            self.stdout.write(style(f'{"SEQ SCAN" if uses_seq_scan else "OK"}: {label}'))
+            self.stdout.write(plan)
+            if uses_seq_scan:
+                seq_scans.append(label)
+        return seq_scans
@@ -1,6 +1,7 @@
 from datetime import datetime
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save
 from django.utils import timezone
 from django_fsm import FSMField, transition, post_transition
 from django.contrib.postgres.fields.jsonb import JSONField
@@ -27,6 +28,7 @@ class Payment(models.Model):
     charge = models.ForeignKey('quantum.Charge', on_delete=models.CASCADE, null=True)
     tx_hash = models.CharField(max_length=100, null=True, default='')
     currency = models.CharField(max_length=50, null=True, default='')
+    output_index = models.IntegerField(default=0)
     from_address = models.CharField(max_length=100, null=True, default='')
     original_amount = models.DecimalField(max_digits=MAX_DIGITS, decimal_places=0)
     rate = models.DecimalField(max_digits=512, decimal_places=0)
@@ -38,6 +40,21 @@ class Payment(models.Model):
     returned_tx_hash = models.CharField(max_length=100, null=True, default='')
     transfer_state_history = JSONField(default=generate_transfer_state_history_default)
 
+    class Meta:
+        indexes = [
+            # queued payments are taken in order of creation
+            models.Index(fields=['transfer_state', 'id']),
+            models.Index(fields=['collection_state', 'currency']),
+            models.Index(fields=['currency', 'created_date']),
+        ]
+        constraints = [
+            # payments by Charge have no tx_hash
+            models.UniqueConstraint(
+                fields=['tx_hash', 'currency', 'output_index'],
+                condition=~models.Q(tx_hash=''),
+                name='unique_payment_tx_output',
+            ),
+        ]
 
     @property
     def adapted_state(self):
@@ -74,18 +91,45 @@ class Payment(models.Model):
         pass
 
 
-def transfer_state_transition_dispatcher(sender, instance, **kwargs):
-    from ducatus_exchange.bot.services import send_or_update_message
+class PaymentTransition(models.Model):
+    """ Outbox of payment state changes, rows are deleted when Telegram subscribers are notified """
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='transitions')
+    transfer_state = models.CharField(max_length=50)
+    created_date = models.DateTimeField(default=timezone.now)
+    claimed_until = models.DateTimeField(null=True, default=None)
+    attempts = models.IntegerField(default=0)
 
-    send_or_update_message(instance)
 
-    # appending to transfer_state_history on status change
+def transfer_state_transition_dispatcher(sender, instance, **kwargs):
+    # appending to transfer_state_history on status change, it is stored by the next save of payment
     instance.transfer_state_history.append(
         {
             "status": instance.adapted_state,
             "timestamp": datetime.now().timestamp()
         })
-    instance.save()
+    # collection state changes do not change notification text, so only transfer state goes to outbox
+    fsm_field = getattr(sender, kwargs['name'])._django_fsm.field
+    if getattr(fsm_field, 'name', fsm_field) == 'transfer_state':
+        instance.__dict__.setdefault('_unsaved_transitions', []).append(instance.transfer_state)
 
 post_transition.connect(transfer_state_transition_dispatcher, Payment)
+
+
+def payment_saved_dispatcher(sender, instance, created, **kwargs):
+    from ducatus_exchange.stats.cache import invalidate, PAYMENTS_GROUP
+    from ducatus_exchange.payments.tasks import deliver_payment_transitions
+
+    if created:
+        # invalidated after commit, so responses cached meanwhile do not miss the new payment
+        transaction.on_commit(lambda: invalidate(PAYMENTS_GROUP))
+
+    # transitions are written to outbox with the save of their state and delivered after commit
+    unsaved_transitions = instance.__dict__.pop('_unsaved_transitions', None)
+    if unsaved_transitions:
+        PaymentTransition.objects.bulk_create(
+            PaymentTransition(payment=instance, transfer_state=state) for state in unsaved_transitions
+        )
+        transaction.on_commit(deliver_payment_transitions.delay)
+
+post_save.connect(payment_saved_dispatcher, Payment)
     
@@ -1,9 +1,9 @@
-from ducatus_exchange.settings import MINIMAL_RETURN
+from ducatus_exchange.settings import MINIMAL_RETURN, DUC_BATCH_TRANSFERS, DUC_TRANSFER_BATCH_SIZE
 from ducatus_exchange.ducatus_api import return_ducatus
 from ducatus_exchange.exchange_requests.models import ExchangeStatus
-from ducatus_exchange.payments.api import check_limits
+from ducatus_exchange.payments.api import check_limits, deliver_payment_transitions as deliver_transitions
 from ducatus_exchange.payments.models import Payment
-from ducatus_exchange.transfers.api import make_ref_transfer, transfer_ducatus
+from ducatus_exchange.transfers.api import make_ref_transfer, transfer_ducatus, transfer_ducatus_batch
 from celery_config import app
 
 
@@ -16,6 +16,18 @@ def process_queued_duc_transfer():
     if pending_payments:
         return 
 
+    if DUC_BATCH_TRANSFERS:
+        payments = Payment.objects.filter(
+            transfer_state='QUEUED',
+            exchange_request__user__platform='DUC'
+        ).exclude(
+            exchange_request__user__address__startswith='voucher',
+            exchange_request__user__ref_address=None
+        ).select_related('exchange_request__user').order_by('id')[:DUC_TRANSFER_BATCH_SIZE]
+        if payments:
+            transfer_ducatus_batch(payments)
+            return
+
     payment = Payment.objects.filter(transfer_state='QUEUED').first()
     if payment:
         user = payment.exchange_request.user     
@@ -28,12 +40,17 @@ def process_queued_duc_transfer():
             _, return_amount = check_limits(payment)
 
             if not ExchangeStatus.objects.first().status:
-                return_ducatus(payment.tx_hash, payment.original_amount)
+                return_ducatus(payment.id, payment.original_amount)
             elif return_amount > MINIMAL_RETURN:
-                return_ducatus(payment.tx_hash, return_amount)
+                return_ducatus(payment.id, return_amount)
             else:
-                return_ducatus(payment.tx_hash, payment.send_amount)
+                return_ducatus(payment.id, payment.send_amount)
         else:
             raise ValueError('Platform is None')
 
     return
+
+
+@app.task
+def deliver_payment_transitions():
+    deliver_transitions()
@@ -0,0 +1,97 @@
+from fractions import Fraction
+from math import floor
+from unittest import mock
+
+from django.test import TestCase
+from web3.datastructures import AttributeDict
+
+from ducatus_exchange.consts import DECIMALS
+from ducatus_exchange.exchange_requests.models import DucatusUser, ExchangeRequest
+from ducatus_exchange.payments.api import parse_payment_manually
+from ducatus_exchange.payments.utils import calculate_amount, calculate_amounts
+from ducatus_exchange.rates.api import RatesSnapshot
+
+
+class CalculateAmountsTest(TestCase):
+    def setUp(self):
+        self.snapshot = RatesSnapshot(
+            version=1,
+            datetime=None,
+            usd_prices={},
+            all_rates={
+                'DUC': {'ETH': '0.00024876', 'BTC': '0.00000646', 'USDC': '16.66666667', 'DUCX': '0.10000000'},
+                'DUCX': {'DUC': '0.10000000'},
+            },
+            stale_currencies=frozenset(),
+        )
+        self.payments = [
+            (2 * DECIMALS['ETH'], 'ETH'),
+            (123456789, 'BTC'),
+            (25 * DECIMALS['USDC'] + 1, 'USDC'),
+            (7 * DECIMALS['DUCX'], 'DUCX'),
+            (3 * DECIMALS['DUC'] + 7, 'DUC'),
+            (1, 'ETH'),
+            (0, 'BTC'),
+        ]
+
+    def expected_amount(self, original_amount, from_currency):
+        to_currency = 'DUCX' if from_currency == 'DUC' else 'DUC'
+        rate = Fraction(self.snapshot.all_rates[to_currency][from_currency])
+        return floor(Fraction(original_amount) * DECIMALS[to_currency] / DECIMALS[from_currency] / rate)
+
+    def test_batch_matches_single_payment(self):
+        batch = calculate_amounts(self.payments, self.snapshot)
+        single = [calculate_amount(amount, currency, self.snapshot) for amount, currency in self.payments]
+        self.assertEqual(batch, single)
+
+    def test_amounts_are_exact_and_rounded_down(self):
+        for (amount, currency), (calculated, rate) in zip(self.payments, calculate_amounts(self.payments,
+                                                                                         self.snapshot)):
+            self.assertEqual(calculated, self.expected_amount(amount, currency))
+            self.assertIsInstance(calculated, int)
+
+        self.assertEqual(calculate_amount(DECIMALS['USDC'], 'USDC', self.snapshot)[0], 5999999)
+        self.assertEqual(calculate_amount(DECIMALS['DUC'], 'DUC', self.snapshot)[0], 10 * DECIMALS['DUCX'])
+
+    def test_rate_of_payment_currency_is_returned(self):
+        rates = [rate for _, rate in calculate_amounts(self.payments, self.snapshot)]
+        self.assertEqual(rates, ['0.00024876', '0.00000646', '16.66666667', '0.10000000', '0.10000000',
+                                 '0.00024876', '0.00000646'])
+
+    def test_empty_batch(self):
+        self.assertEqual(calculate_amounts([], self.snapshot), [])
+
+
+@mock.patch('ducatus_exchange.payments.api.parse_payment_message')
+@mock.patch('ducatus_exchange.payments.api.Web3')
+class ParsePaymentManuallyTest(TestCase):
+    address = '0x52908400098527886e0f7030069857d2e4169ee7'
+    checksum_address = '0x52908400098527886E0F7030069857D2E4169EE7'
+
+    def setUp(self):
+        user = DucatusUser.objects.create(address='Mx7qtYqNp8W4K9wyzRtuGcJ8ygPbdUBPqC', platform='DUC')
+        self.exchange_request = ExchangeRequest.objects.create(user=user, ducx_address=self.address,
+                                                               eth_address=self.address)
+
+    def mock_transaction(self, web3_class, status=1):
+        eth = web3_class.return_value.eth
+        eth.getTransactionReceipt.return_value = AttributeDict({'status': status, 'to': self.checksum_address})
+        eth.getTransaction.return_value = AttributeDict({'from': '0xsender', 'value': 5 * DECIMALS['DUCX']})
+
+    def test_checksummed_receiver_matches_lowercased_address(self, web3_class, parse_payment_message):
+        self.mock_transaction(web3_class)
+        for currency in ['DUCX', 'ETH']:
+            with mock.patch.dict('ducatus_exchange.payments.api.NETWORK_SETTINGS', {currency: {'url': 'http://node'}}):
+                parse_payment_manually('0xhash', currency)
+
+            message = parse_payment_message.call_args[0][0]
+            self.assertEqual(message['exchangeId'], self.exchange_request.id)
+            self.assertEqual(message['currency'], currency)
+            self.assertEqual(message['amount'], 5 * DECIMALS['DUCX'])
+
+    def test_failed_transaction(self, web3_class, parse_payment_message):
+        self.mock_transaction(web3_class, status=0)
+        with mock.patch.dict('ducatus_exchange.payments.api.NETWORK_SETTINGS', {'DUCX': {'url': 'http://node'}}):
+            with self.assertRaises(ValueError):
+                parse_payment_manually('0xhash', 'DUCX')
+        parse_payment_message.assert_not_called()
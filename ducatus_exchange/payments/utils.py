@@ -1,11 +1,17 @@
 import logging
 from datetime import datetime
+from decimal import Decimal, localcontext
 
-from ducatus_exchange.rates.serializers import AllRatesSerializer
+from ducatus_exchange.rates.api import get_rates_snapshot
 from ducatus_exchange.consts import DECIMALS
 
 logger = logging.getLogger(__name__)
 
+# rates are formatted with 8 decimal places by rates snapshot
+RATE_DECIMAL_PLACES = 8
+# enough significant digits for any amount in smallest units multiplied by decimals
+AMOUNT_PRECISION = 80
+
 
 def generate_transfer_state_history_default() -> list:
     return [{
@@ -14,21 +20,50 @@ def generate_transfer_state_history_default() -> list:
     }]
 
 
-def calculate_amount(original_amount, from_currency):
+def get_conversion(from_currency, snapshot):
+    """ Returns rate and integer numerator/denominator to convert `from_currency` amount with it """
     to_currency = 'DUCX' if from_currency == 'DUC' else 'DUC'
-    logger.info(msg=f'Calculating amount, original: {original_amount}, from {from_currency} to {to_currency}')
-
-    rates = AllRatesSerializer({})
-    currency_rate = rates.data[to_currency][from_currency]
+    currency_rate = snapshot.all_rates[to_currency][from_currency]
+    rate_units = int(Decimal(currency_rate).scaleb(RATE_DECIMAL_PLACES))
 
     if from_currency in ['ETH', 'DUCX', 'BTC', 'USDC', 'USDT']:
-        value = original_amount * DECIMALS['DUC'] / DECIMALS[from_currency]
+        numerator, denominator = DECIMALS['DUC'], DECIMALS[from_currency]
     elif from_currency == 'DUC':
-        value = original_amount * DECIMALS[to_currency] / DECIMALS['DUC']
+        numerator, denominator = DECIMALS[to_currency], DECIMALS['DUC']
     else:
-        value = original_amount
+        numerator, denominator = 1, 1
+
+    return currency_rate, numerator * 10 ** RATE_DECIMAL_PLACES, denominator * rate_units
+
+
+def calculate_amounts(payments, snapshot=None):
+    """
+    Prices many (original_amount, from_currency) pairs with one rates snapshot
+
+    Amounts are calculated with exact decimal arithmetic and rounded down,
+    returns list of (amount, rate) in the same order
+    """
+    snapshot = snapshot or get_rates_snapshot()
+    conversions = {}
+    result = []
+    with localcontext() as context:
+        context.prec = AMOUNT_PRECISION
+        for original_amount, from_currency in payments:
+            conversion = conversions.get(from_currency)
+            if conversion is None:
+                conversion = conversions[from_currency] = get_conversion(from_currency, snapshot)
+            currency_rate, numerator, denominator = conversion
+            amount = int(Decimal(original_amount) * numerator // denominator)
+            result.append((amount, currency_rate))
+
+    return result
+
+
+def calculate_amount(original_amount, from_currency, snapshot=None):
+    to_currency = 'DUCX' if from_currency == 'DUC' else 'DUC'
+    logger.info(msg=f'Calculating amount, original: {original_amount}, from {from_currency} to {to_currency}')
 
-    logger.info(msg=f'value: {value}, rate: {currency_rate}')
-    amount = int(float(value) / float(currency_rate))
+    amount, currency_rate = calculate_amounts([(original_amount, from_currency)], snapshot)[0]
+    logger.info(msg=f'amount: {amount}, rate: {currency_rate}')
 
     return amount, currency_rate
@@ -1,4 +1,5 @@
 import logging
+from decimal import Decimal, localcontext
 
 from django.db import IntegrityError
 from drf_yasg import openapi
@@ -12,24 +13,19 @@ from ducatus_exchange.consts import DECIMALS
 from ducatus_exchange.payments.models import Payment
 from ducatus_exchange.quantum.models import Charge
 from ducatus_exchange.quantum.serializers import ChargeSerializer
-from ducatus_exchange.rates.models import UsdRate
+from ducatus_exchange.rates.api import get_rates_snapshot
 from ducatus_exchange.payments.api import create_voucher, send_voucher_email
+from ducatus_exchange.payments.utils import AMOUNT_PRECISION
 
 
 logger = logging.getLogger(__name__)
 
 
-def get_rates():
-    usd_prices = {}
-    rate = UsdRate.objects.first()
+def get_rates(snapshot=None):
+    snapshot = snapshot or get_rates_snapshot()
+    usd_prices = {currency: snapshot.usd_prices[currency] for currency in ('USD', 'EUR', 'GBP', 'CHF', 'DUC')}
 
-    usd_prices['USD'] = rate.usd_price
-    usd_prices['EUR'] = rate.eur_price
-    usd_prices['GBP'] = rate.gbp_price
-    usd_prices['CHF'] = rate.chf_price
-    usd_prices['DUC'] = rate.duc_price
-
-    logger.info(msg=f'current quantum rates: {usd_prices}')
+    logger.info(msg=f'current quantum rates: {usd_prices} (version {snapshot.version})')
     return usd_prices
 
 
@@ -123,7 +119,8 @@ def change_charge_status(request: Request):
                 return Response(200)
 
             logger.info(msg=f'try create voucher for charge {charge_id}')
-            usd_amount, _ = calculate_amount(charge, 'USD')
+            rates = get_rates()
+            usd_amount, _ = calculate_amount(charge, 'USD', rates)
             raw_usd_amount = usd_amount / DECIMALS['USD']
             try:
                 voucher = create_voucher(raw_usd_amount, charge_id=charge_id)
@@ -132,7 +129,7 @@ def change_charge_status(request: Request):
                     raise e
                 voucher = create_voucher(raw_usd_amount, charge_id=charge_id)
 
-            sent_amount, duc_rate = calculate_amount(charge, 'DUC')
+            sent_amount, duc_rate = calculate_amount(charge, 'DUC', rates)
             charge.create_payment(sent_amount, duc_rate)
             send_voucher_email(voucher, charge.email, raw_usd_amount)
             charge.status = status
@@ -140,12 +137,13 @@ def change_charge_status(request: Request):
     return Response(200)
 
 
-def calculate_amount(charge, curr):
-    rates = get_rates()
+def calculate_amount(charge, curr, rates=None):
+    rates = rates or get_rates()
     rate = rates.get(curr, None)
     dec = DECIMALS.get(curr, None)
     if not rate and not dec:
         raise KeyError(f'Cant calculate rate with currency {curr}')
-    value = charge.amount * dec / DECIMALS[charge.currency]
-    usd_amount = int(value / float(rate))
+    with localcontext() as context:
+        context.prec = AMOUNT_PRECISION
+        usd_amount = int(Decimal(charge.amount) * dec // (DECIMALS[charge.currency] * Decimal(str(rate))))
     return usd_amount, rate
@@ -0,0 +1,83 @@
+import time
+import logging
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+from ducatus_exchange.rates.models import UsdRate, UsdRateHistory
+from ducatus_exchange.settings import RATES_SNAPSHOT_POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# immutable view of UsdRate or UsdRateHistory row, `all_rates` has the same format as AllRatesSerializer output
+RatesSnapshot = namedtuple('RatesSnapshot', ['version', 'datetime', 'usd_prices', 'all_rates', 'stale_currencies'])
+
+# currencies which are exchanged to DUC and DUCX, with rates shown by AllRatesSerializer
+EXCHANGE_CURRENCIES = ('ETH', 'BTC', 'USDC', 'DUC', 'DUCX', 'USDT')
+
+_snapshot = None
+_checked_at = 0
+_lock = threading.Lock()
+
+
+def build_snapshot(rate, version=None, stale_currencies=()):
+    usd_prices = rate.get_usd_prices()
+
+    duc_prices = {
+        currency: '{0:.8f}'.format(usd_prices['DUC'] / usd_prices[currency])
+        for currency in EXCHANGE_CURRENCIES if currency != 'DUC'
+    }
+    ducx_prices = {
+        'DUC': '{0:.8f}'.format(usd_prices['DUCX'] / usd_prices['DUC'])
+    }
+    all_rates = {
+        'DUC': MappingProxyType(duc_prices),
+        'DUCX': MappingProxyType(ducx_prices),
+    }
+
+    return RatesSnapshot(
+        version,
+        rate.datetime,
+        MappingProxyType(usd_prices),
+        MappingProxyType(all_rates),
+        frozenset(stale_currencies),
+    )
+
+
+def get_rates_snapshot():
+    """
+    Returns current rates snapshot, shared by all threads of the process
+
+    Database is checked for new rates version at most once in RATES_SNAPSHOT_POLL_INTERVAL seconds,
+    callers should take snapshot once and use it for the whole request
+    """
+    global _snapshot, _checked_at
+
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - _checked_at < RATES_SNAPSHOT_POLL_INTERVAL:
+        return snapshot
+
+    with _lock:
+        if _snapshot is not None and time.monotonic() - _checked_at < RATES_SNAPSHOT_POLL_INTERVAL:
+            return _snapshot
+
+        version = UsdRate.objects.values_list('version', flat=True).first()
+        if _snapshot is None or version != _snapshot.version:
+            rate = UsdRate.objects.first()
+            _snapshot = build_snapshot(rate, rate.version, rate.stale_currencies)
+            logger.info(msg=f'rates snapshot updated to version {_snapshot.version}: {dict(_snapshot.usd_prices)}')
+        _checked_at = time.monotonic()
+        return _snapshot
+
+
+def get_rates_at(moment):
+    """
+    Returns snapshot of rates which were current at `moment`
+
+    Falls back to current rates when history does not reach that far, snapshot version is None for history rows
+    """
+    rate = UsdRateHistory.objects.filter(datetime__lte=moment).order_by('-datetime').first()
+    if rate is None:
+        logger.warning(msg=f'no rates history for {moment}, current rates are used')
+        return get_rates_snapshot()
+    return build_snapshot(rate)
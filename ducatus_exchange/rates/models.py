@@ -1,7 +1,8 @@
 from django.db import models
+from django.contrib.postgres.fields import ArrayField
 
 
-class UsdRate(models.Model):
+class UsdPrices(models.Model):
     btc_price = models.FloatField()
     eth_price = models.FloatField()
     usdc_price = models.FloatField(default=1)
@@ -11,7 +12,9 @@ class UsdRate(models.Model):
     chf_price = models.FloatField()
     duc_price = models.FloatField()
     ducx_price = models.FloatField()
-    datetime = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
 
     def update_rates(self, BTC, ETH, USDC, USD, EUR, GBP, CHF, DUC, DUCX):
         self.btc_price = BTC
@@ -23,3 +26,33 @@ class UsdRate(models.Model):
         self.chf_price = CHF
         self.duc_price = DUC
         self.ducx_price = DUCX
+
+    def get_usd_prices(self):
+        return {
+            'ETH': self.eth_price,
+            'BTC': self.btc_price,
+            'USDC': self.usdc_price,
+            'DUC': self.duc_price,
+            'DUCX': self.ducx_price,
+            'USDT': self.usd_price,
+            'USD': self.usd_price,
+            'EUR': self.eur_price,
+            'GBP': self.gbp_price,
+            'CHF': self.chf_price,
+        }
+
+
+class UsdRate(UsdPrices):
+    datetime = models.DateTimeField(auto_now=True)
+    version = models.IntegerField(default=0)
+    # currencies which could not be fetched on last update and keep previous price
+    stale_currencies = ArrayField(models.CharField(max_length=10), default=list)
+
+    def update_rates(self, *args, **kwargs):
+        super().update_rates(*args, **kwargs)
+        self.version += 1
+
+
+class UsdRateHistory(UsdPrices):
+    """ Append-only copy of every UsdRate update, prices are valid from `datetime` until next row """
+    datetime = models.DateTimeField(db_index=True)
@@ -1,20 +1,10 @@
 from rest_framework import serializers
-from ducatus_exchange.rates.models import UsdRate
+from ducatus_exchange.rates.api import get_rates_snapshot, EXCHANGE_CURRENCIES
 
 
-def get_usd_prices():
-    usd_prices = {}
-    rate = UsdRate.objects.first()
-    usd_prices['ETH'] = rate.eth_price
-    usd_prices['BTC'] = rate.btc_price
-    usd_prices['USDC'] = rate.usdc_price
-    usd_prices['DUC'] = rate.duc_price
-    usd_prices['DUCX'] = rate.ducx_price
-    usd_prices['USDT'] = rate.usd_price
-
-    print('current rates', usd_prices, flush=True)
-
-    return usd_prices
+def get_usd_prices(snapshot=None):
+    snapshot = snapshot or get_rates_snapshot()
+    return {currency: snapshot.usd_prices[currency] for currency in EXCHANGE_CURRENCIES}
 
 
 class DucRateSerializer(serializers.Serializer):
@@ -32,22 +22,5 @@ class AllRatesSerializer(serializers.Serializer):
     DUCX = DucxRateSerializer
 
     def to_representation(self, instance):
-        usd_price = get_usd_prices()
-
-        duc_prices = {currency: usd_price['DUC'] / price for currency, price in usd_price.items()}
-        duc_prices.pop('DUC')
-
-        ducx_price = {
-            'DUC': usd_price['DUCX'] / usd_price['DUC']
-        }
-
-        all_rates = {
-            'DUC': duc_prices,
-            'DUCX': ducx_price
-        }
-
-        for rate in all_rates.values():
-            for currency in rate:
-                rate[currency] = '{0:.8f}'.format(rate[currency])
-
-        return all_rates
+        snapshot = get_rates_snapshot()
+        return {currency: dict(rates) for currency, rates in snapshot.all_rates.items()}
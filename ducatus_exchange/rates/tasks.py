@@ -0,0 +1,12 @@
+import logging
+
+from ducatus_exchange.rates.utils import downsample_rate_history
+from celery_config import app
+
+logger = logging.getLogger(__name__)
+
+
+@app.task
+def downsample_rates_history():
+    downsampled, expired = downsample_rate_history()
+    logger.info(msg=f'rates history: {downsampled} rows downsampled, {expired} rows expired')
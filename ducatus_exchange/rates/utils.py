@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from ducatus_exchange.rates.models import UsdRateHistory
+from ducatus_exchange.settings import RATE_HISTORY_FULL_DAYS, RATE_HISTORY_DOWNSAMPLE_MINUTES, \
+    RATE_HISTORY_RETENTION_DAYS
+
+
+def downsample_rate_history():
+    """
+    Keeps only the last row of every RATE_HISTORY_DOWNSAMPLE_MINUTES interval in old history
+    and deletes history older than retention period
+
+    Returns numbers of downsampled and expired rows
+    """
+    now = timezone.now()
+    downsample_before = now - timedelta(days=RATE_HISTORY_FULL_DAYS)
+    expire_before = now - timedelta(days=RATE_HISTORY_RETENTION_DAYS)
+    bucket_seconds = RATE_HISTORY_DOWNSAMPLE_MINUTES * 60
+
+    expired, _ = UsdRateHistory.objects.filter(datetime__lt=expire_before).delete()
+
+    table = UsdRateHistory._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE datetime < %s AND id NOT IN ('
+            f'SELECT DISTINCT ON (floor(extract(epoch from datetime) / %s)) id FROM {table} '
+            f'WHERE datetime < %s '
+            f'ORDER BY floor(extract(epoch from datetime) / %s), datetime DESC'
+            f')',
+            [downsample_before, bucket_seconds, downsample_before, bucket_seconds]
+        )
+        downsampled = cursor.rowcount
+
+    return downsampled, expired
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
     'ducatus_exchange.stats',
     'ducatus_exchange.quantum',
     'ducatus_exchange.bot',
+    'ducatus_exchange.mails',
 ]
 
 MIDDLEWARE = [
@@ -176,6 +177,104 @@ RABBITMQ_URL = 'amqp://{user}:{password}@{hostname}:5672/{vhost}'.format(
     vhost=RABBITMQ_VHOST,
 )
 
+# receiver pool mode: messages of one network are handled by several workers,
+# messages of the same exchange request always go to the same worker
+RECEIVER_WORKERS = int(os.getenv('RECEIVER_WORKERS', 1))
+
+RECEIVER_PREFETCH_COUNT = int(os.getenv('RECEIVER_PREFETCH_COUNT', 10))
+
+# failed message is retried after RECEIVER_RETRY_DELAY seconds through `<queue>.retry` queue,
+# after RECEIVER_MAX_RETRIES attempts it is parked in `<queue>.failed` queue for manual handling
+RECEIVER_MAX_RETRIES = int(os.getenv('RECEIVER_MAX_RETRIES', 10))
+RECEIVER_RETRY_DELAY = int(os.getenv('RECEIVER_RETRY_DELAY', 60))
+
+# seconds before a pending outgoing DUCX transaction is rebroadcasted or replaced with higher gas price
+DUCX_STUCK_TX_TIMEOUT = int(os.getenv('DUCX_STUCK_TX_TIMEOUT', 300))
+
+DUCX_GAS_PRICE_BUMP_PERCENT = int(os.getenv('DUCX_GAS_PRICE_BUMP_PERCENT', 10))
+
+# stuck DUCX transaction is bumped at most DUCX_MAX_GAS_BUMPS times and never above DUCX_MAX_GAS_PRICE (wei),
+# then it is marked STUCK and left for manual handling
+DUCX_MAX_GAS_BUMPS = int(os.getenv('DUCX_MAX_GAS_BUMPS', 5))
+DUCX_MAX_GAS_PRICE = int(os.getenv('DUCX_MAX_GAS_PRICE', 200 * 10 ** 9))
+
+# pay all queued DUC payments with one sendmany transaction
+DUC_BATCH_TRANSFERS = os.getenv('DUC_BATCH_TRANSFERS', 'False').lower() == 'true'
+
+DUC_TRANSFER_BATCH_SIZE = int(os.getenv('DUC_TRANSFER_BATCH_SIZE', 200))
+
+# shared http client for explorer apis (ducatus_exchange.http_client)
+HTTP_CLIENT_TIMEOUT = float(os.getenv('HTTP_CLIENT_TIMEOUT', 10))
+
+HTTP_CLIENT_RETRIES = int(os.getenv('HTTP_CLIENT_RETRIES', 3))
+
+HTTP_CLIENT_BACKOFF = float(os.getenv('HTTP_CLIENT_BACKOFF', 0.5))
+
+HTTP_CLIENT_POOL_SIZE = int(os.getenv('HTTP_CLIENT_POOL_SIZE', 20))
+
+# how many dirty stats addresses are refreshed and written back at once
+STATS_BALANCE_BATCH_SIZE = int(os.getenv('STATS_BALANCE_BATCH_SIZE', 500))
+
+# statistics endpoints cache, it is invalidated by stats_checker and new payments,
+# so backend is shared between processes for invalidation to reach web workers.
+# Default database cache table is created with `manage.py createcachetable`
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'django_cache'),
+    }
+}
+
+STATS_CACHE_TIMEOUT = int(os.getenv('STATS_CACHE_TIMEOUT', 60))
+
+# seconds between checks of new rates version by rates snapshot (ducatus_exchange.rates.api)
+RATES_SNAPSHOT_POLL_INTERVAL = float(os.getenv('RATES_SNAPSHOT_POLL_INTERVAL', 1))
+
+# seconds to wait for all rates requests of one rates_checker cycle
+RATES_FETCH_DEADLINE = float(os.getenv('RATES_FETCH_DEADLINE', 3))
+# seconds between rates_checker cycles, RATES_CHECKER_TIMEOUT by default, can be set less than one second
+RATES_REFRESH_INTERVAL = float(os.getenv('RATES_REFRESH_INTERVAL', 0)) or None
+
+# rates history older than RATE_HISTORY_FULL_DAYS keeps one row per RATE_HISTORY_DOWNSAMPLE_MINUTES,
+# rows older than RATE_HISTORY_RETENTION_DAYS are deleted
+RATE_HISTORY_FULL_DAYS = int(os.getenv('RATE_HISTORY_FULL_DAYS', 7))
+RATE_HISTORY_DOWNSAMPLE_MINUTES = int(os.getenv('RATE_HISTORY_DOWNSAMPLE_MINUTES', 5))
+RATE_HISTORY_RETENTION_DAYS = int(os.getenv('RATE_HISTORY_RETENTION_DAYS', 365))
+
+# payment transitions delivered to Telegram by one deliver_payment_transitions run
+PAYMENT_OUTBOX_BATCH_SIZE = int(os.getenv('PAYMENT_OUTBOX_BATCH_SIZE', 100))
+
+# Telegram notifications: global messages rate, concurrent requests and retries on 429
+BOT_MESSAGES_PER_SECOND = float(os.getenv('BOT_MESSAGES_PER_SECOND', 25))
+BOT_SEND_WORKERS = int(os.getenv('BOT_SEND_WORKERS', 8))
+BOT_MAX_RETRIES = int(os.getenv('BOT_MAX_RETRIES', 3))
+# seconds for which payment transitions are claimed by one delivering worker
+PAYMENT_OUTBOX_CLAIM_TIMEOUT = int(os.getenv('PAYMENT_OUTBOX_CLAIM_TIMEOUT', 300))
+# failed payment transition is retried after claim timeout, at most PAYMENT_OUTBOX_MAX_ATTEMPTS times
+PAYMENT_OUTBOX_MAX_ATTEMPTS = int(os.getenv('PAYMENT_OUTBOX_MAX_ATTEMPTS', 10))
+
+# outbound mail queue: mails per worker run, attempts, first retry delay and claim time in seconds
+MAIL_BATCH_SIZE = int(os.getenv('MAIL_BATCH_SIZE', 50))
+MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', 5))
+MAIL_RETRY_BACKOFF = int(os.getenv('MAIL_RETRY_BACKOFF', 60))
+MAIL_CLAIM_TIMEOUT = int(os.getenv('MAIL_CLAIM_TIMEOUT', 600))
+
+# seconds to wait for DUCX node JSON-RPC response
+PARITY_RPC_TIMEOUT = float(os.getenv('PARITY_RPC_TIMEOUT', 10))
+
+# DUC node rpc: connections per process, request timeout and seconds between health checks
+DUC_RPC_POOL_SIZE = int(os.getenv('DUC_RPC_POOL_SIZE', 4))
+DUC_RPC_TIMEOUT = int(os.getenv('DUC_RPC_TIMEOUT', 30))
+DUC_RPC_HEALTH_CHECK_INTERVAL = int(os.getenv('DUC_RPC_HEALTH_CHECK_INTERVAL', 60))
+
+# BTC fee is estimated for confirmation within BTC_FEE_TARGET_BLOCKS and cached for BTC_FEE_CACHE_TTL seconds
+BTC_FEE_TARGET_BLOCKS = int(os.getenv('BTC_FEE_TARGET_BLOCKS', 3))
+BTC_FEE_CACHE_TTL = int(os.getenv('BTC_FEE_CACHE_TTL', 300))
+
+# withdrawal sweeps: concurrent workers and addresses checked with one batch request
+SWEEP_WORKERS = int(os.getenv('SWEEP_WORKERS', 8))
+SWEEP_BATCH_SIZE = int(os.getenv('SWEEP_BATCH_SIZE', 100))
+
 try:
     from ducatus_exchange.settings_local import *
 except ImportError:
@@ -0,0 +1 @@
+default_app_config = 'ducatus_exchange.stats.apps.StatsConfig'
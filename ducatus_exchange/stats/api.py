@@ -1,11 +1,7 @@
-from .models import StatisticsAddress
 from ducatus_exchange.settings import DUCX_NODE_ADDRESSES
-from ducatus_exchange.ducatus_api import DucatusXAPI
-from stats_checker import update_balances
+from ducatus_exchange.stats.utils import mark_addresses_dirty
 
 
 def update_nodes():
-    ducx_api = DucatusXAPI()
-    for node in DUCX_NODE_ADDRESSES:
-        address = StatisticsAddress.objects.get_or_create(user_address=node, network='DUCX')
-    update_balances(ducx_api, DUCX_NODE_ADDRESSES)
+    """ Queues node addresses for balance refresh by DUCX stats_checker """
+    mark_addresses_dirty('DUCX', DUCX_NODE_ADDRESSES)
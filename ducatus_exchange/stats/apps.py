@@ -1,6 +1,23 @@
+import logging
+
 from django.apps import AppConfig
+from django.db.models.signals import pre_migrate
+
+logger = logging.getLogger(__name__)
+
+
+def delete_duplicate_transfers_before_migrate(sender, using, **kwargs):
+    """ Duplicates are removed before migration adds unique constraint on StatisticsTransfer.tx_hash """
+    from ducatus_exchange.stats.utils import delete_duplicate_transfers
+
+    deleted = delete_duplicate_transfers(using)
+    if deleted:
+        logger.info(msg=f'deleted {deleted} duplicate statistics transfers')
 
 
 class StatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ducatus_exchange.stats'
+
+    def ready(self):
+        pre_migrate.connect(delete_duplicate_transfers_before_migrate, sender=self)
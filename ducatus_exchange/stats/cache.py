@@ -0,0 +1,54 @@
+import logging
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from ducatus_exchange.settings import STATS_CACHE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# cached responses are grouped by data they are built from, every group is invalidated separately
+TRANSFERS_GROUP = 'transfers'
+PAYMENTS_GROUP = 'payments'
+
+
+def get_generation_key(group):
+    return f'stats_cache_generation:{group}'
+
+
+def invalidate(group):
+    """
+    Makes all cached responses of the group stale by moving group to the next generation
+
+    Cache failures are logged and never break the caller, which may be saving a payment.
+    Database cache is used within savepoint, so its error does not abort caller's transaction
+    """
+    try:
+        with transaction.atomic():
+            try:
+                cache.incr(get_generation_key(group))
+            except ValueError:
+                cache.set(get_generation_key(group), 1, None)
+    except Exception as e:
+        logger.error(msg=f'cannot invalidate stats cache group {group}: {e!r}')
+
+
+def cached_response(group, timeout=STATS_CACHE_TIMEOUT):
+    """ Caches successful response of APIView method by full request path until timeout or invalidation """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            generation = cache.get_or_set(get_generation_key(group), 0, None)
+            key = f'stats_cache:{group}:{generation}:{request.get_full_path()}'
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, timeout)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ducatus_exchange.stats.models import StatisticsHourlyRollup
+from ducatus_exchange.stats.utils import rebuild_hourly_rollup
+
+
+class Command(BaseCommand):
+    help = 'Recalculates hourly transfer rollup from all saved transfers'
+
+    def handle(self, *args, **options):
+        rebuild_hourly_rollup()
+        self.stdout.write(self.style.SUCCESS(
+            f'hourly rollup rebuilt: {StatisticsHourlyRollup.objects.count()} buckets'
+        ))
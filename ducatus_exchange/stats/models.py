@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 from ducatus_exchange.consts import MAX_DIGITS
 
@@ -22,10 +23,28 @@ class StatisticsAddress(models.Model):
 class StatisticsTransfer(models.Model):
     transaction_value = models.DecimalField(max_digits=MAX_DIGITS, decimal_places=0)
     transaction_time = models.DateTimeField()
-    tx_hash = models.CharField(max_length=256, null=True, default='')
+    tx_hash = models.CharField(max_length=256, null=True, default=None, unique=True)
     currency = models.CharField(max_length=10)
     address_from = models.ForeignKey(StatisticsAddress, on_delete=models.CASCADE,
                                      related_name='address_from', null=True, default=None)
     address_to = models.ForeignKey(StatisticsAddress, on_delete=models.CASCADE,
                                    related_name='address_to', null=True, default=None)
     fee_amount = models.DecimalField(max_digits=MAX_DIGITS, decimal_places=0, default=0)
+
+
+class StatisticsDirtyAddress(models.Model):
+    """ Address which balance changed since last refresh """
+    user_address = models.CharField(max_length=100, unique=True)
+    network = models.CharField(max_length=100)
+    marked_at = models.DateTimeField(default=timezone.now)
+
+
+class StatisticsHourlyRollup(models.Model):
+    """ Count and value of transfers per currency and hour, maintained by stats_checker """
+    currency = models.CharField(max_length=10)
+    hour = models.DateTimeField()
+    transaction_count = models.IntegerField(default=0)
+    transaction_value = models.DecimalField(max_digits=MAX_DIGITS, decimal_places=0, default=0)
+
+    class Meta:
+        unique_together = (('currency', 'hour'),)
@@ -0,0 +1,136 @@
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from psycopg2.extras import execute_values
+
+from ducatus_exchange.stats.models import StatisticsAddress, StatisticsDirtyAddress, StatisticsTransfer, \
+    StatisticsHourlyRollup
+
+
+def upsert_addresses(network, balances):
+    """
+    Creates missing addresses and updates balances of existing ones with single statement
+
+    `balances` maps address to its balance, None keeps balance stored in database.
+    Returns mapping of address to StatisticsAddress id
+    """
+    if not balances:
+        return {}
+
+    table = StatisticsAddress._meta.db_table
+    with connection.cursor() as cursor:
+        rows = execute_values(
+            cursor,
+            f'INSERT INTO {table} (user_address, network, balance) VALUES %s '
+            f'ON CONFLICT (user_address) DO UPDATE SET balance = COALESCE(EXCLUDED.balance, {table}.balance) '
+            f'RETURNING id, user_address',
+            [(address, network, balance) for address, balance in balances.items()],
+            page_size=len(balances),
+            fetch=True,
+        )
+    return {address: address_id for address_id, address in rows}
+
+
+def mark_addresses_dirty(network, addresses):
+    """ Queues addresses for balance refresh, address marked several times is refreshed once """
+    addresses = set(addresses)
+    if not addresses:
+        return
+
+    table = StatisticsDirtyAddress._meta.db_table
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        execute_values(
+            cursor,
+            f'INSERT INTO {table} (user_address, network, marked_at) VALUES %s '
+            f'ON CONFLICT (user_address) DO UPDATE SET marked_at = EXCLUDED.marked_at',
+            [(address, network, now) for address in addresses],
+            page_size=len(addresses),
+        )
+
+
+def insert_transfers(transfers):
+    """ Inserts transfers skipping already saved hashes, returns only transfers which were inserted """
+    if not transfers:
+        return []
+
+    table = StatisticsTransfer._meta.db_table
+    with connection.cursor() as cursor:
+        rows = execute_values(
+            cursor,
+            f'INSERT INTO {table} (transaction_value, transaction_time, tx_hash, currency, '
+            f'address_from_id, address_to_id, fee_amount) VALUES %s '
+            f'ON CONFLICT (tx_hash) DO NOTHING RETURNING tx_hash',
+            [
+                (transfer.transaction_value, transfer.transaction_time, transfer.tx_hash, transfer.currency,
+                 transfer.address_from_id, transfer.address_to_id, transfer.fee_amount or 0)
+                for transfer in transfers
+            ],
+            page_size=len(transfers),
+            fetch=True,
+        )
+    inserted_hashes = set(tx_hash for tx_hash, in rows)
+    return [transfer for transfer in transfers if transfer.tx_hash in inserted_hashes]
+
+
+def delete_duplicate_transfers(using='default'):
+    """
+    Keeps only the first saved transfer of every tx hash
+
+    Transfers were deduplicated with racy check-then-insert before tx_hash became unique,
+    so existing tables can contain duplicates which would fail the unique constraint
+    """
+    table = StatisticsTransfer._meta.db_table
+    with connections[using].cursor() as cursor:
+        if table not in connections[using].introspection.table_names(cursor):
+            return 0
+        cursor.execute(
+            f'DELETE FROM {table} duplicate USING {table} original '
+            f'WHERE duplicate.tx_hash = original.tx_hash AND duplicate.id > original.id'
+        )
+        return cursor.rowcount
+
+
+def add_to_hourly_rollup(transfers):
+    """ Adds just saved transfers to their hourly buckets """
+    buckets = {}
+    for transfer in transfers:
+        key = (transfer.currency, transfer.transaction_time.replace(minute=0, second=0, microsecond=0))
+        count, value = buckets.get(key, (0, 0))
+        buckets[key] = (count + 1, value + int(transfer.transaction_value))
+    if not buckets:
+        return
+
+    table = StatisticsHourlyRollup._meta.db_table
+    with connection.cursor() as cursor:
+        execute_values(
+            cursor,
+            f'INSERT INTO {table} (currency, hour, transaction_count, transaction_value) VALUES %s '
+            f'ON CONFLICT (currency, hour) DO UPDATE SET '
+            f'transaction_count = {table}.transaction_count + EXCLUDED.transaction_count, '
+            f'transaction_value = {table}.transaction_value + EXCLUDED.transaction_value',
+            [(currency, hour, count, value) for (currency, hour), (count, value) in buckets.items()],
+            page_size=len(buckets),
+        )
+
+
+def rebuild_hourly_rollup():
+    """ Recalculates rollup from all saved transfers, to be run once after deploy or if rollup got out of sync """
+    rollup_table = StatisticsHourlyRollup._meta.db_table
+    transfer_table = StatisticsTransfer._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        # stats checkers wait until rebuild is committed, so their transfers are counted exactly once
+        cursor.execute(f'LOCK TABLE {rollup_table} IN EXCLUSIVE MODE')
+        cursor.execute(f'DELETE FROM {rollup_table}')
+        cursor.execute(
+            f'INSERT INTO {rollup_table} (currency, hour, transaction_count, transaction_value) '
+            f"SELECT currency, date_trunc('hour', transaction_time), count(*), sum(transaction_value) "
+            f"FROM {transfer_table} GROUP BY currency, date_trunc('hour', transaction_time)"
+        )
+
+
+def backfill_hourly_rollup():
+    """ Builds rollup on first start after deploy, when transfers are saved but rollup is still empty """
+    if StatisticsHourlyRollup.objects.exists() or not StatisticsTransfer.objects.exists():
+        return False
+    rebuild_hourly_rollup()
+    return True
@@ -1,21 +1,25 @@
 # Create your views here.
 from datetime import timedelta, datetime
 import csv
+import math
 import os
+import zlib
 import logging
 
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ReadOnlyModelViewSet
 from rest_framework import status
 
-from ducatus_exchange.stats.models import StatisticsTransfer, StatisticsAddress, BitcoreAddress
+from ducatus_exchange.stats.models import StatisticsAddress, BitcoreAddress, StatisticsHourlyRollup
 from ducatus_exchange.stats.serializers import DucWalletsSerializer, BitcoreWalletsSerializer
 from ducatus_exchange.settings import BASE_DIR
 from ducatus_exchange.payments.models import Payment
-from django.db.models import Sum
+from django.db.models import Sum, Q
+from django.db.models.expressions import RawSQL
 from ducatus_exchange.stats.models import DucatusAddressBlacklist
+from ducatus_exchange.stats.cache import cached_response, TRANSFERS_GROUP, PAYMENTS_GROUP
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +27,7 @@ logger = logging.getLogger(__name__)
 class DucToDucxSwap(APIView):
     """Summing dayly swap ducatus to ducatusx"""
 
+    @cached_response(PAYMENTS_GROUP)
     def get(self, request):
         time = datetime.now() - timedelta(hours=24)
         duc = Payment.objects.filter(currency='DUC', created_date__gt=time) \
@@ -39,6 +44,7 @@ class DucToDucxSwap(APIView):
 class DucxToDucSwap(APIView):
     """Summing dayly swap ducatusx to ducatus"""
 
+    @cached_response(PAYMENTS_GROUP)
     def get(self, request):
         time = datetime.now() - timedelta(hours=24)
         ducx = Payment.objects.filter(currency='DUCX', created_date__gt=time) \
@@ -56,6 +62,7 @@ class DucxToDucSwap(APIView):
 class StatisticsTotals(APIView):
     """ Summing total amount in saved wallets """
 
+    @cached_response(TRANSFERS_GROUP)
     def get(self, request):
         duc_blacklist = DucatusAddressBlacklist.objects.filter(network='DUC').values('wallet_address')
         duc_address_sum = StatisticsAddress.objects.filter(network='DUC') \
@@ -74,49 +81,45 @@ class StatisticsTotals(APIView):
 
 
 class StatsHandler(APIView):
+    """ Transfers graph served from hourly rollup, so cost does not depend on transfers amount """
+
+    @cached_response(TRANSFERS_GROUP)
     def get(self, request, currency, days):
-        data = []
         now = datetime.now()
-        time = datetime.now() - timedelta(days=days)
+        start = now - timedelta(days=days)
         period = {1: 2, 7: 2, 30: 24, 365: 168}
-        daily_txs = StatisticsTransfer.objects.filter(
-            transaction_time__gt=now - timedelta(hours=24)) \
-            .filter(transaction_time__lte=now) \
-            .filter(currency=currency)
-        weekly_txs = StatisticsTransfer.objects.filter(
-            transaction_time__gt=now - timedelta(hours=24 * 7)) \
-            .filter(transaction_time__lte=now) \
-            .filter(currency=currency)
-        daily_tx_count = daily_txs.count()
-        weekly_txs_count = weekly_txs.count()
-        daily_value = 0
-        weekly_value = 0
-        for tx in daily_txs:
-            daily_value += tx.transaction_value
-        for tx in weekly_txs:
-            weekly_value += tx.transaction_value
-        while time < now:
-            statistics = StatisticsTransfer.objects.filter(
-                transaction_time__gt=time) \
-                .filter(transaction_time__lte=time + timedelta(hours=period[days])) \
-                .filter(currency=currency)
-            time += timedelta(hours=period[days])
-            if time > now:
-                time = now
-            value = 0
-            count = statistics.count()
-            for stat in statistics:
-                value += stat.transaction_value
+        period_hours = period[days]
+
+        rollup = StatisticsHourlyRollup.objects.filter(currency=currency, hour__lte=now)
+
+        totals = rollup.aggregate(
+            daily_value=Sum('transaction_value', filter=Q(hour__gt=now - timedelta(hours=24))),
+            daily_count=Sum('transaction_count', filter=Q(hour__gt=now - timedelta(hours=24))),
+            weekly_value=Sum('transaction_value', filter=Q(hour__gt=now - timedelta(hours=24 * 7))),
+            weekly_count=Sum('transaction_count', filter=Q(hour__gt=now - timedelta(hours=24 * 7))),
+        )
+
+        bucket = RawSQL('greatest(0, floor(extract(epoch from (hour - %s)) / %s))', (start, period_hours * 3600))
+        buckets = rollup.filter(hour__gt=start - timedelta(hours=1)) \
+            .annotate(bucket=bucket) \
+            .values('bucket') \
+            .annotate(value=Sum('transaction_value'), count=Sum('transaction_count'))
+        buckets = {int(row['bucket']): row for row in buckets}
+
+        data = []
+        buckets_amount = math.ceil(days * 24 / period_hours)
+        for i in range(buckets_amount):
+            row = buckets.get(i, {})
             data.append({
-                'value': value,
-                'count': count,
-                'time': time
+                'value': row.get('value') or 0,
+                'count': row.get('count') or 0,
+                'time': min(start + timedelta(hours=period_hours * (i + 1)), now)
             })
         return Response({
-            'daily_value': daily_value,
-            'daily_count': daily_tx_count,
-            'weekly_value': weekly_value,
-            'weekly_count': weekly_txs_count,
+            'daily_value': totals['daily_value'] or 0,
+            'daily_count': totals['daily_count'] or 0,
+            'weekly_value': totals['weekly_value'] or 0,
+            'weekly_count': totals['weekly_count'] or 0,
             'graph_data': data
         }, status=status.HTTP_200_OK)
 
@@ -139,24 +142,54 @@ class BitcoreWalletsViewSet(ReadOnlyModelViewSet):
     serializer_class = BitcoreWalletsSerializer
 
 
+class Echo:
+    """ File-like object for csv.writer which returns written line instead of storing it """
+
+    def write(self, value):
+        return value
+
+
+def iterate_wallets_csv(currency, rows_in_chunk=1000):
+    writer = csv.writer(Echo())
+    yield writer.writerow(['address', 'balance'])
+
+    accounts = StatisticsAddress.objects.filter(network=currency, balance__gt=0) \
+        .values_list('user_address', 'balance') \
+        .iterator(chunk_size=rows_in_chunk)
+    chunk = []
+    for address, balance in accounts:
+        chunk.append(writer.writerow([address, int(balance)]))
+        if len(chunk) >= rows_in_chunk:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode())
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
 class DucWalletsToCSV(APIView):
+    """ Streams wallets with positive balance as csv, `?compress=gzip` to get .csv.gz """
 
     def get(self, request, currency):
         currency = currency.upper()
         if currency not in ['DUC', 'DUCX']:
             return Response('unknown currency', status=status.HTTP_400_BAD_REQUEST)
 
-        account_list = []
-        for account in StatisticsAddress.objects.filter(network=currency, balance__gt=0):
-            account_list.append([account.user_address, account.balance])
-
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment;' \
-                                          f' filename="{currency}_wallet_export_{str(datetime.now().date())}.csv"'
-        writer = csv.DictWriter(response, fieldnames=['address', 'balance'])
-        writer.writeheader()
-        for acc in account_list:
-            writer.writerow({'address': acc[0], 'balance': int(float(acc[1]))})
-
+        filename = f'{currency}_wallet_export_{str(datetime.now().date())}.csv'
+        if request.query_params.get('compress') == 'gzip':
+            response = StreamingHttpResponse(gzip_stream(iterate_wallets_csv(currency)),
+                                             content_type='application/gzip')
+            filename += '.gz'
+        else:
+            response = StreamingHttpResponse(iterate_wallets_csv(currency), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
 
         return response
@@ -1,4 +1,3 @@
-import time
 import sys
 import traceback
 import logging
@@ -8,11 +7,12 @@ from django.db import transaction
 from ducatus_exchange.litecoin_rpc import DucatuscoreInterface
 from ducatus_exchange.parity_interface import ParityInterface, ParityInterfaceException
 from ducatus_exchange.transfers.models import DucatusTransfer
+from ducatus_exchange.transfers.scheduler import DucxTransactionScheduler
 from ducatus_exchange.settings import ROOT_KEYS, REF_BONUS_PERCENT, MINIMAL_RETURN, DUCX_GAS_PRICE, DUCX_TRANSFER_GAS_LIMIT
 from ducatus_exchange.bip32_ducatus import DucatusWallet
-from ducatus_exchange.consts import DAYLY_LIMIT, WEEKLY_LIMIT
 from ducatus_exchange.payments.utils import calculate_amount
-from ducatus_exchange.exchange_requests.models import ExchangeRequest
+from ducatus_exchange.rates.api import get_rates_at
+from ducatus_exchange.exchange_requests.utils import reserve_swap_limits
 from ducatus_exchange.ducatus_api import return_ducatus, return_ducatusx
 from ducatus_exchange.exchange_requests.models import ExchangeStatus
 
@@ -24,39 +24,31 @@ class TransferException(Exception):
 
 
 def check_limits(payment):
-    dayly_reserve = 0
-    weekly_reserve = 0
-    original_amount=payment.original_amount
-    if payment.original_amount + payment.exchange_request.dayly_swap > DAYLY_LIMIT:
-        dayly_reserve = DAYLY_LIMIT - payment.exchange_request.dayly_swap
-        logger.info(msg=dayly_reserve)
-        payment.original_amount = dayly_reserve
-        if dayly_reserve <= 0:
-            return False, original_amount
-    if payment.original_amount + payment.exchange_request.weekly_swap > WEEKLY_LIMIT:
-        weekly_reserve = WEEKLY_LIMIT - payment.exchange_request.weekly_swap
-        if dayly_reserve > 0:
-            payment.original_amount = min(dayly_reserve, weekly_reserve)
-        else:
-            payment.original_amount = weekly_reserve
-        if weekly_reserve <= 0:
-            return False, original_amount
-    logger.info(msg=f' amount {payment.original_amount}')
-    exchange_request=ExchangeRequest.objects.get(id=payment.exchange_request.id)
-    exchange_request.dayly_swap += payment.original_amount
-    exchange_request.weekly_swap += payment.original_amount
-    exchange_request.save()
-    logger.info(msg=f'daily {exchange_request.dayly_swap}')
+    original_amount = payment.original_amount
+    reserved_amount = reserve_swap_limits(payment.exchange_request_id, original_amount)
+    logger.info(msg=f' amount {reserved_amount}')
+    if reserved_amount <= 0:
+        return False, original_amount
+    payment.original_amount = reserved_amount
     if payment.original_amount !=original_amount:
-        payment.sent_amount, payment.rate = calculate_amount(payment.original_amount, payment.currency)
+        # recalculate on the rate payment was registered with, not on the current one
+        payment.sent_amount, payment.rate = calculate_amount(
+            payment.original_amount,
+            payment.currency,
+            get_rates_at(payment.created_date)
+        )
         logger.info(msg=f"User's {payment.exchange_request.user.id} sent_amount was recalculated due to limits")
         payment.save()
         return True, original_amount-payment.original_amount
     return True, 0
 
 
+def get_ref_bonus_amount(payment):
+    return Decimal(int(int(Decimal(payment.sent_amount)) * REF_BONUS_PERCENT))
+
+
 def make_ref_transfer(payment):
-    amount = Decimal(int(int(Decimal(payment.sent_amount)) * REF_BONUS_PERCENT))
+    amount = get_ref_bonus_amount(payment)
     receiver = payment.exchange_request.user.ref_address
     logger.info(msg=f'ducatus transfer started: sending {amount} DUC to {receiver}')
     currency = 'DUC'
@@ -78,7 +70,7 @@ def transfer_ducatus(payment):
     status = ExchangeStatus.objects.all().first().status
     if not status:
         logger.info(msg='exchange is disabled')
-        return_ducatusx(payment.tx_hash, payment.original_amount)
+        return_ducatusx(payment.id, payment.original_amount)
         return
 
     rpc = DucatuscoreInterface()
@@ -94,19 +86,74 @@ def transfer_ducatus(payment):
         return transfer
     else:
         logger.info(msg=f'Not enough balance on wallet DUC, transaction with hash {payment.tx_hash} will return to user on DUCX')
-        return_ducatusx(payment.tx_hash, payment.original_amount)
+        return_ducatusx(payment.id, payment.original_amount)
+
+def transfer_ducatus_batch(payments):
+    """
+    Pays queued DUC payments (and referral bonuses of voucher payments) with single sendmany transaction
+
+    Payments which do not fit in wallet balance are returned to user on DUCX, as in transfer_ducatus
+    """
+    status = ExchangeStatus.objects.all().first().status
+    if not status:
+        logger.info(msg='exchange is disabled')
+
+    rpc = DucatuscoreInterface()
+    balance = rpc.get_balance()
+    outputs = {}
+    total_amount = 0
+    batch = []
+    for payment in payments:
+        user = payment.exchange_request.user
+        is_voucher = user.address.startswith('voucher')
+        if is_voucher:
+            if not user.ref_address:
+                continue
+            receiver, amount = user.ref_address, get_ref_bonus_amount(payment)
+        elif not status:
+            return_ducatusx(payment.id, payment.original_amount)
+            continue
+        else:
+            receiver, amount = user.address, payment.sent_amount
+
+        if total_amount + amount >= balance:
+            logger.info(msg=f'Not enough balance on wallet DUC for payment with hash {payment.tx_hash}')
+            if not is_voucher:
+                return_ducatusx(payment.id, payment.original_amount)
+            continue
+
+        outputs[receiver] = outputs.get(receiver, 0) + amount
+        total_amount += amount
+        batch.append((payment, amount))
+
+    if not batch:
+        return []
+
+    logger.info(msg=f'ducatus batch transfer started: sending {total_amount} DUC for {len(batch)} payments')
+    tx = rpc.transfer_many(outputs)
+
+    transfers = []
+    with transaction.atomic():
+        for payment, amount in batch:
+            transfers.append(save_transfer(payment, tx, amount, 'DUC'))
+            payment.state_transfer_pending()
+            payment.save()
+
+    logger.info(msg=f'ducatus batch transfer ok: {tx}')
+    return transfers
+
 
 def transfer_ducatusx(payment):
     status = ExchangeStatus.objects.all().first().status
     if not status:
         logger.info(msg='exchange is disabled')
-        return_ducatus(payment.tx_hash, payment.original_amount)
+        return_ducatus(payment.id, payment.original_amount)
         return
 
     allowed, return_amount = check_limits(payment)
 
     if return_amount > MINIMAL_RETURN:
-        return_ducatus(payment.tx_hash, return_amount)
+        return_ducatus(payment.id, return_amount)
 
     if not allowed:
         logger.info(
@@ -120,12 +167,12 @@ def transfer_ducatusx(payment):
     try:
         if parity.get_balance() < amount + DUCX_GAS_PRICE * DUCX_TRANSFER_GAS_LIMIT:
             logger.info(msg=f'Not enough balance on wallet DUCX, transaction with hash {payment.tx_hash} will return to user on DUC')
-            return_ducatus(payment.tx_hash, payment.original_amount)
+            return_ducatus(payment.id, payment.original_amount)
             return
 
         logger.info(msg=f'ducatusX transfer started: sending {amount} DUCX to {receiver}')
         
-        tx = parity.transfer(receiver, amount)
+        tx = DucxTransactionScheduler(parity).send(receiver, amount)
         transfer = save_transfer(payment, tx, amount, 'DUCX')
         transaction.on_commit(lambda: (
             payment.state_transfer_pending(), 
@@ -133,8 +180,6 @@ def transfer_ducatusx(payment):
         ))
 
         logger.info(msg='ducatusx transfer ok')
-        time.sleep(100) #  small timeout in case of multiple payment messages
-        logger.info(msg='transfer completed')
         
         return transfer
     except ParityInterfaceException as e:
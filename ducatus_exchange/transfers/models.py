@@ -1,4 +1,6 @@
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
+from django.utils import timezone
 
 from ducatus_exchange.consts import MAX_DIGITS
 from ducatus_exchange.payments.models import Payment
@@ -21,3 +23,47 @@ class DucatusTransfer(models.Model):
     @transition(field=state, source='*', target='DONE')
     def state_done(self):
         pass
+
+
+class DucatusXNonce(models.Model):
+    """ Next nonce to use for outgoing DUCX transactions of the address """
+    address = models.CharField(max_length=50, unique=True)
+    nonce = models.IntegerField(default=0)
+
+
+class DucatusXTransaction(models.Model):
+    """ Outgoing DUCX transaction sent through DucxTransactionScheduler """
+    STATES = ('PENDING', 'MINED', 'REPLACED', 'STUCK')
+    STATES = list(zip(STATES, STATES))
+    from_address = models.CharField(max_length=50)
+    to_address = models.CharField(max_length=50)
+    nonce = models.IntegerField()
+    amount = models.DecimalField(max_digits=MAX_DIGITS, decimal_places=0)
+    gas_price = models.DecimalField(max_digits=MAX_DIGITS, decimal_places=0)
+    tx_hash = models.CharField(max_length=100)
+    # hashes sent earlier for the same nonce with lower gas price, any of them can still be mined
+    replaced_hashes = ArrayField(models.CharField(max_length=100), default=list, blank=True)
+    raw_tx = models.TextField()
+    state = FSMField(default='PENDING', choices=STATES)
+    created_date = models.DateTimeField(auto_now_add=True)
+    sent_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = (('from_address', 'nonce'),)
+
+    @property
+    def sent_hashes(self):
+        return [*self.replaced_hashes, self.tx_hash]
+
+    # States change
+    @transition(field=state, source=['PENDING', 'STUCK'], target='MINED')
+    def state_mined(self):
+        pass
+
+    @transition(field=state, source=['PENDING', 'STUCK'], target='REPLACED')
+    def state_replaced(self):
+        pass
+
+    @transition(field=state, source='PENDING', target='STUCK')
+    def state_stuck(self):
+        pass
@@ -0,0 +1,174 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+from web3 import Web3
+
+from ducatus_exchange.consts import DECIMALS
+from ducatus_exchange.exchange_requests.models import ExchangeRequest
+from ducatus_exchange.parity_interface import ParityInterface, ParityInterfaceException
+from ducatus_exchange.payments.models import Payment
+from ducatus_exchange.settings import ROOT_KEYS, DUCX_GAS_PRICE, DUCX_STUCK_TX_TIMEOUT, DUCX_GAS_PRICE_BUMP_PERCENT, \
+    DUCX_MAX_GAS_BUMPS, DUCX_MAX_GAS_PRICE
+from ducatus_exchange.transfers.models import DucatusTransfer, DucatusXNonce, DucatusXTransaction
+from ducatus_exchange.withdrawals.utils import get_private_keys
+
+logger = logging.getLogger(__name__)
+
+
+class DucxTransactionScheduler:
+    """
+    Sends DUCX transactions with locally assigned nonces
+
+    Nonce of every sending address is kept in DucatusXNonce and assigned under row lock,
+    so several transactions can be sent one after another without waiting for them to be mined.
+    Deposit addresses are also spent by withdrawal sweeps, so their nonce is synced with node before every send.
+    Sent transactions are stored in DucatusXTransaction to be rebroadcasted or bumped when stuck.
+    """
+
+    def __init__(self, parity=None):
+        self.parity = parity or ParityInterface()
+
+    def send(self, address, amount, from_address=None, from_private=None):
+        from_address = (from_address or self.parity.settings['address']).lower()
+        from_private = from_private or self.parity.settings['private']
+
+        logger.info(msg='DUCATUSX TRANSFER STARTED: {address}, {amount} DUCX'.format(
+            address=address,
+            amount=amount / DECIMALS['DUCX']
+        ))
+
+        try:
+            with transaction.atomic():
+                counter = self.lock_nonce(from_address)
+                signed = self.parity.sign_transfer(address, amount, counter.nonce, DUCX_GAS_PRICE, from_private)
+                tx_hash = self.parity.eth_sendRawTransaction(signed.rawTransaction.hex())
+
+                DucatusXTransaction(
+                    from_address=from_address,
+                    to_address=address.lower(),
+                    nonce=counter.nonce,
+                    amount=amount,
+                    gas_price=DUCX_GAS_PRICE,
+                    tx_hash=tx_hash,
+                    raw_tx=signed.rawTransaction.hex(),
+                ).save()
+                counter.nonce += 1
+                counter.save()
+        except Exception as e:
+            err = 'DUCATUSX TRANSFER ERROR: transfer for {amount} DUCX for {addr} failed' \
+                .format(amount=amount / DECIMALS['DUCX'], addr=address)
+            logger.error(msg=err)
+            logger.error(msg=e)
+            if 'nonce' in str(e).lower():
+                # local nonce is out of sync with node, it will be fetched again on next send
+                DucatusXNonce.objects.filter(address=from_address).delete()
+            raise ParityInterfaceException(err)
+
+        logger.info(msg=f'TXID: {tx_hash} (nonce {counter.nonce - 1})')
+        return tx_hash
+
+    def lock_nonce(self, address):
+        counter = DucatusXNonce.objects.select_for_update().filter(address=address).first()
+        if counter is None:
+            DucatusXNonce.objects.get_or_create(address=address, defaults={'nonce': self.get_node_nonce(address)})
+            counter = DucatusXNonce.objects.select_for_update().get(address=address)
+        elif address != self.parity.settings['address'].lower():
+            # only hot wallet is spent exclusively through scheduler
+            counter.nonce = max(counter.nonce, self.get_node_nonce(address))
+        return counter
+
+    def get_node_nonce(self, address):
+        return int(self.parity.eth_getTransactionCount(Web3.toChecksumAddress(address), 'pending'), 16)
+
+    def get_private_key(self, address):
+        if address == self.parity.settings['address'].lower():
+            return self.parity.settings['private']
+        exchange_request = ExchangeRequest.objects.get(ducx_address=address.lower())
+        return get_private_keys(ROOT_KEYS['ducatusx']['private'], exchange_request.user.id)[0]
+
+    def process_stuck_transactions(self):
+        sent_before = timezone.now() - timedelta(seconds=DUCX_STUCK_TX_TIMEOUT)
+        # STUCK transactions are not bumped anymore, but still checked to be mined
+        stuck_transactions = DucatusXTransaction.objects.filter(
+            state__in=['PENDING', 'STUCK'],
+            sent_date__lt=sent_before
+        ).order_by('from_address', 'nonce')
+        for tx in stuck_transactions:
+            try:
+                self.process_stuck_transaction(tx)
+            except Exception as e:
+                logger.error(msg=f'could not process stuck DUCX transaction {tx.tx_hash}')
+                logger.error(msg=e)
+
+    def process_stuck_transaction(self, tx):
+        sent_hashes = tx.sent_hashes
+        *receipts, mined_nonce, node_tx = self.parity.batch(
+            *(('eth_getTransactionReceipt', tx_hash) for tx_hash in sent_hashes),
+            ('eth_getTransactionCount', Web3.toChecksumAddress(tx.from_address), 'latest'),
+            ('eth_getTransactionByHash', tx.tx_hash),
+        )
+        mined_hash = next((tx_hash for tx_hash, receipt in zip(sent_hashes, receipts) if receipt), None)
+        if mined_hash:
+            self.set_mined(tx, mined_hash)
+            return
+
+        if int(mined_nonce, 16) > tx.nonce:
+            logger.warning(msg=f'nonce {tx.nonce} of {tx.from_address} was used by another transaction, '
+                               f'none of {tx.sent_hashes} will be mined')
+            tx.state_replaced()
+            tx.save()
+            return
+
+        if not node_tx:
+            logger.info(msg=f'DUCX transaction {tx.tx_hash} is missing on node, rebroadcasting')
+            self.parity.eth_sendRawTransaction(tx.raw_tx)
+            tx.sent_date = timezone.now()
+            tx.save()
+            return
+
+        if tx.state == 'STUCK':
+            return
+
+        gas_price = self.get_bumped_gas_price(tx)
+        if len(tx.replaced_hashes) >= DUCX_MAX_GAS_BUMPS or gas_price > DUCX_MAX_GAS_PRICE:
+            logger.error(msg=f'DUCX transaction {tx.tx_hash} with nonce {tx.nonce} of {tx.from_address} is not mined '
+                             f'after {len(tx.replaced_hashes)} gas price bumps (gas price {tx.gas_price}), '
+                             f'it needs manual handling')
+            tx.state_stuck()
+            tx.save()
+            return
+
+        self.bump_gas_price(tx, gas_price)
+
+    @staticmethod
+    def get_bumped_gas_price(tx):
+        return int(tx.gas_price) * (100 + DUCX_GAS_PRICE_BUMP_PERCENT) // 100
+
+    def bump_gas_price(self, tx, gas_price):
+        signed = self.parity.sign_transfer(
+            tx.to_address, tx.amount, tx.nonce, gas_price, self.get_private_key(tx.from_address)
+        )
+        tx_hash = self.parity.eth_sendRawTransaction(signed.rawTransaction.hex())
+        logger.info(msg=f'DUCX transaction {tx.tx_hash} replaced with {tx_hash} (gas price {gas_price})')
+
+        # transfer keeps first hash until one of sent transactions is mined
+        tx.replaced_hashes.append(tx.tx_hash)
+        tx.tx_hash = tx_hash
+        tx.raw_tx = signed.rawTransaction.hex()
+        tx.gas_price = gas_price
+        tx.sent_date = timezone.now()
+        tx.save()
+
+    def set_mined(self, tx, mined_hash):
+        """ Points transfer and returned payment to the hash which was actually mined """
+        sent_hashes = tx.sent_hashes
+        if mined_hash != sent_hashes[0]:
+            logger.info(msg=f'DUCX transaction with nonce {tx.nonce} of {tx.from_address} mined as {mined_hash}')
+            DucatusTransfer.objects.filter(tx_hash__in=sent_hashes).update(tx_hash=mined_hash)
+            Payment.objects.filter(returned_tx_hash__in=sent_hashes).update(returned_tx_hash=mined_hash)
+        tx.replaced_hashes = [tx_hash for tx_hash in sent_hashes if tx_hash != mined_hash]
+        tx.tx_hash = mined_hash
+        tx.state_mined()
+        tx.save()
@@ -0,0 +1,7 @@
+from ducatus_exchange.transfers.scheduler import DucxTransactionScheduler
+from celery_config import app
+
+
+@app.task
+def process_stuck_ducx_transactions():
+    DucxTransactionScheduler().process_stuck_transactions()
@@ -6,23 +6,30 @@ import logging
 import time
 import requests
 import collections
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from web3 import Web3, HTTPProvider
 from web3.exceptions import TransactionNotFound
 from eth_account import Account
 from eth_keys import keys
 from bip32utils import BIP32Key
 
+from django.utils import timezone
+
 from ducatus_exchange.exchange_requests.models import ExchangeRequest
-from ducatus_exchange.settings import NETWORK_SETTINGS, ROOT_KEYS, DUCX_GAS_PRICE
-from ducatus_exchange.rates.models import UsdRate
-from ducatus_exchange.withdrawals.utils import get_private_keys
+from ducatus_exchange.exchange_requests.utils import get_funded_accounts, clear_funded_addresses, \
+    SWEEP_ADDRESS_FIELDS
+from ducatus_exchange.settings import NETWORK_SETTINGS, ROOT_KEYS, DUCX_GAS_PRICE, SWEEP_WORKERS, SWEEP_BATCH_SIZE
+from ducatus_exchange.rates.api import get_rates_snapshot
+from ducatus_exchange.withdrawals.utils import get_private_keys, normalize_gas_price
 from ducatus_exchange.consts import DECIMALS
 from ducatus_exchange.bitcoin_api import BitcoinAPI, BitcoinRPC
+from ducatus_exchange.withdrawals.sweep import SweepEngine
 
 logger = logging.getLogger('withdraw')
 
 
-def withdraw_ducx_funds():
+def withdraw_ducx_funds(full_scan=False):
 
     withdraw_parameters = {
         'root_private_key': ROOT_KEYS['ducx']['private'],
@@ -34,16 +41,29 @@ def withdraw_ducx_funds():
             logger.info(f'Value not found for parameter {key}. Aborting')
             return
 
-    all_requests = ExchangeRequest.objects.all().exclude(generated_address=None)
-    for account in all_requests:
-        ducx_priv_key, _ = get_private_keys(withdraw_parameters['root_private_key'], account.user.id)
-        process_withdraw_ducx(withdraw_parameters, account, ducx_priv_key)
-
-def normalize_gas_price(gas_price):
-    gwei_decimals = 10 ** 9
-    gas = int(round(gas_price / gwei_decimals, 0)) * gwei_decimals
-    lower_gas = gas - 1 if gas > 2 else gas
-    return gas, lower_gas
+    swept_from = timezone.now()
+    engine = SweepEngine(
+        NETWORK_SETTINGS['DUCX']['endpoint'],
+        withdraw_parameters['root_private_key'],
+        NETWORK_SETTINGS['DUCX']['address'],
+        normalize_gas_price(DUCX_GAS_PRICE),
+    )
+    engine.sweep(get_sweep_accounts('DUCX', full_scan))
+    clear_funded_addresses('DUCX', engine.swept, swept_from)
+
+
+def get_sweep_accounts(network, full_scan=False):
+    """
+    Returns iterator of (address, user_id) to sweep on network
+
+    Only addresses from funded index are swept, full scan visits deposit addresses of every exchange request
+    """
+    if full_scan:
+        address_field = SWEEP_ADDRESS_FIELDS[network]
+        accounts = ExchangeRequest.objects.exclude(**{address_field: None}).values_list(address_field, 'user_id')
+    else:
+        accounts = get_funded_accounts(network)
+    return accounts.iterator(chunk_size=SWEEP_BATCH_SIZE)
 
 
 def process_withdraw_ducx(params, account, priv_key):
@@ -80,7 +100,7 @@ def process_withdraw_ducx(params, account, priv_key):
     return
 
 
-def withdraw_eth_funds():
+def withdraw_eth_funds(full_scan=False):
     withdraw_parameters = {
         'root_private_key': ROOT_KEYS['mainnet']['private'],
         'root_public_key': ROOT_KEYS['mainnet']['public'],
@@ -118,19 +138,15 @@ def withdraw_eth_funds():
         time.sleep(7 * 60)
     '''
     print('ETH WITHDRAW', flush=True)
-    for account in all_requests:
-        eth_priv_key, _ = get_private_keys(withdraw_parameters['root_private_key'], account.user.id)
-        logger.info(f'ETH address: {account.eth_address}, {Account.from_key(eth_priv_key).address}')
-        '''
-        if account.eth_address in delayed_transactions_addresses:
-            logger.info('address {} skipped because of delayed gas transaction'.format(account.eth_address))
-            continue
-        '''
-        try:
-            process_withdraw_eth(withdraw_parameters, account, eth_priv_key)
-        except Exception as e:
-            print('ETH withdraw failed. Error is:', flush=True)
-            print(e, flush=True)
+    swept_from = timezone.now()
+    # gas price is taken from ETH node by the engine
+    engine = SweepEngine(
+        NETWORK_SETTINGS['ETH']['url'],
+        withdraw_parameters['root_private_key'],
+        NETWORK_SETTINGS['ETH']['address'],
+    )
+    engine.sweep(get_sweep_accounts('ETH', full_scan))
+    clear_funded_addresses('ETH', engine.swept, swept_from)
 
 
 def process_send_gas_for_usdc(params, account, priv_key, transactions, currency):
@@ -144,10 +160,9 @@ def process_send_gas_for_usdc(params, account, priv_key, transactions, currency)
     erc20_gas_price, erc20_fake_gas_price = normalize_gas_price(web3.eth.gasPrice)
     total_gas_fee = gas_price * gas_limit
     erc20_gas_fee = erc20_gas_price * erc20_gas_limit
-    rate = UsdRate.objects.get(currency='ETH')
-    rate = rate.rate
-    token_rate = UsdRate.objects.get(currency=currency)
-    token_rate = token_rate.rate
+    usd_prices = get_rates_snapshot().usd_prices
+    rate = usd_prices['ETH']
+    token_rate = usd_prices[currency]
     from_address = account.eth_address
     to_address = NETWORK_SETTINGS['ETH']['address']
 
@@ -306,7 +321,7 @@ def check_tx(tx):
             return True
 
 
-def withdraw_btc_funds():
+def withdraw_btc_funds(full_scan=False):
     withdraw_parameters = {
         'root_private_key': ROOT_KEYS['mainnet']['private'],
         'root_public_key': ROOT_KEYS['mainnet']['public'],
@@ -319,32 +334,71 @@ def withdraw_btc_funds():
             return
 
     all_requests = ExchangeRequest.objects.all().exclude(btc_address=None)
+    if not full_scan:
+        all_requests = all_requests.filter(funded_addresses__network='BTC')
+    swept_from = timezone.now()
+    swept = set()
     logger.info('BTC WITHDRAW')
-    for user in all_requests:
-        eth_priv_key, btc_priv_key = get_private_keys(withdraw_parameters['root_private_key'], user.user.id)
-        logger.info(f'BTC address: {user.btc_address}')
+    # one api client and node connection for the whole sweep
+    api = BitcoinAPI()
+    rpc = BitcoinRPC()
+    totals = {'checked': 0, 'funded': 0, 'sent': 0, 'failed': 0}
+
+    def get_unspent(account):
         try:
-            process_withdraw_btc(withdraw_parameters, user, btc_priv_key)
+            return account, api.get_address_unspent_all(account.btc_address)
         except Exception as e:
-            logger.info('BTC withdraw failed. Error is:')
-            logger.info(e)
-
-
-def process_withdraw_btc(params, account, priv_key):
+            logger.info(f'Failed to fetch information about BTC address {account.btc_address}: {e}')
+            return account, ([], 0, False)
+
+    # unspent outputs are fetched concurrently in bounded batches, node connection is used by one thread
+    accounts = all_requests.select_related('user').iterator(chunk_size=SWEEP_BATCH_SIZE)
+    with ThreadPoolExecutor(max_workers=SWEEP_WORKERS) as executor:
+        while True:
+            batch = list(itertools.islice(accounts, SWEEP_BATCH_SIZE))
+            if not batch:
+                break
+            for user, unspent in executor.map(get_unspent, batch):
+                totals['checked'] += 1
+                inputs, value, response_ok = unspent
+                if not response_ok:
+                    continue
+                if value < rpc.relay_fee:
+                    # nothing to sweep until next deposit, which marks address funded again
+                    swept.add(user.btc_address)
+                    continue
+                totals['funded'] += 1
+                eth_priv_key, btc_priv_key = get_private_keys(withdraw_parameters['root_private_key'], user.user.id)
+                logger.info(f'BTC address: {user.btc_address}')
+                try:
+                    sent_tx_hash = process_withdraw_btc(withdraw_parameters, user, btc_priv_key, api, rpc, unspent)
+                except Exception as e:
+                    sent_tx_hash = None
+                    logger.info('BTC withdraw failed. Error is:')
+                    logger.info(e)
+                totals['sent' if sent_tx_hash else 'failed'] += 1
+                if sent_tx_hash:
+                    swept.add(user.btc_address)
+            logger.info(f'BTC sweep progress: {totals}')
+    clear_funded_addresses('BTC', swept, swept_from)
+    logger.info(f'BTC sweep finished: {totals}')
+
+
+def process_withdraw_btc(params, account, priv_key, api=None, rpc=None, unspent=None):
     if isinstance(account, str):
         from_address = account
     else:
         from_address = account.btc_address
     to_address = params['address_to_btc']
-    api = BitcoinAPI()
-    inputs, value, response_ok = api.get_address_unspent_all(from_address)
+    api = api or BitcoinAPI()
+    inputs, value, response_ok = unspent or api.get_address_unspent_all(from_address)
     if not response_ok:
         logger.info(f'Failed to fetch information about BTC address {from_address}')
         return
     balance = int(value)
     if balance <= 0:
         balance = 0
-    rpc = BitcoinRPC()
+    rpc = rpc or BitcoinRPC()
     transaction_fee = rpc.relay_fee
     if balance < transaction_fee:
         logger.info(f'Address skipped: {from_address}: balance {balance} < tx fee of {transaction_fee}')
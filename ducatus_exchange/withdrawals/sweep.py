@@ -0,0 +1,121 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from web3 import Web3
+from eth_account import Account
+
+from ducatus_exchange.parity_interface import ParityInterface
+from ducatus_exchange.settings import SWEEP_WORKERS, SWEEP_BATCH_SIZE
+from ducatus_exchange.withdrawals.utils import get_private_keys, normalize_gas_price
+
+logger = logging.getLogger('withdraw')
+
+GAS_LIMIT = 21000
+
+
+class SweepEngine:
+    """
+    Moves native coin balances of deposit addresses to hot wallet
+
+    Addresses are checked with batched JSON-RPC balance and nonce requests, only funded ones are signed
+    and broadcasted by a bounded pool of workers. Node client, chainId and gas price are shared by the whole sweep
+    """
+
+    def __init__(self, endpoint, root_private_key, to_address, gas_price=None, workers=SWEEP_WORKERS,
+                 batch_size=SWEEP_BATCH_SIZE):
+        """ `gas_price` is a pair of (gas price, fake gas price), see normalize_gas_price; node gas price if None """
+        self.parity = ParityInterface(endpoint)
+        self.root_private_key = root_private_key
+        self.to_address = Web3.toChecksumAddress(to_address)
+        self.gas_price, self.fake_gas_price = gas_price or normalize_gas_price(int(self.parity.eth_gasPrice(), 16))
+        self.total_gas_fee = self.gas_price * GAS_LIMIT
+        self.chain_id = self.parity.chain_id
+        self.workers = workers
+        self.batch_size = batch_size
+        self.totals = {'checked': 0, 'funded': 0, 'sent': 0, 'failed': 0, 'amount': 0}
+        # addresses left without sweepable balance: swept successfully or holding less than gas fee
+        self.swept = set()
+
+    def get_funded(self, accounts):
+        """ Returns (address, user_id, balance, nonce) of accounts which can pay for withdrawal """
+        addresses = [Web3.toChecksumAddress(address) for address, _ in accounts]
+        balances = [
+            int(balance, 16)
+            for balance in self.parity.batch(*(('eth_getBalance', address, 'latest') for address in addresses))
+        ]
+        self.swept.update(
+            address for address, balance in zip(addresses, balances) if balance <= self.total_gas_fee
+        )
+        funded = [
+            (address, user_id, balance)
+            for address, (_, user_id), balance in zip(addresses, accounts, balances)
+            if balance > self.total_gas_fee
+        ]
+        if not funded:
+            return []
+        nonces = self.parity.batch(*(('eth_getTransactionCount', address, 'pending') for address, _, _ in funded))
+        return [
+            (address, user_id, balance, int(nonce, 16))
+            for (address, user_id, balance), nonce in zip(funded, nonces)
+        ]
+
+    def withdraw(self, address, user_id, balance, nonce):
+        withdraw_amount = balance - self.total_gas_fee
+        tx_params = {
+            'chainId': self.chain_id,
+            'gas': GAS_LIMIT,
+            'nonce': nonce,
+            'gasPrice': self.fake_gas_price,
+            'to': self.to_address,
+            'value': withdraw_amount,
+        }
+        try:
+            priv_key, _ = get_private_keys(self.root_private_key, user_id)
+            signed_tx = Account.signTransaction(tx_params, priv_key)
+            sent_tx = self.parity.eth_sendRawTransaction(signed_tx['rawTransaction'].hex())
+        except Exception as e:
+            logger.error(f'Refund failed for address {address} and amount {withdraw_amount} '
+                         f'({balance} - {self.total_gas_fee})')
+            logger.error(e)
+            return 0
+        logger.info(f'sent tx: {sent_tx} from {address} on amount {withdraw_amount}')
+        return withdraw_amount
+
+    def sweep(self, accounts):
+        """
+        Sweeps `accounts`, iterable of (address, user_id), and returns totals
+
+        Progress is logged after every batch of addresses
+        """
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            batch = []
+            for account in accounts:
+                batch.append(account)
+                if len(batch) >= self.batch_size:
+                    self.sweep_batch(executor, batch)
+                    batch = []
+            if batch:
+                self.sweep_batch(executor, batch)
+
+        logger.info(f'sweep to {self.to_address} finished in {time.monotonic() - started:.1f}s: {self.totals}')
+        return self.totals
+
+    def sweep_batch(self, executor, batch):
+        try:
+            funded = self.get_funded(batch)
+        except Exception as e:
+            logger.error(f'cannot check balances of {len(batch)} addresses: {e!r}')
+            self.totals['checked'] += len(batch)
+            self.totals['failed'] += len(batch)
+            return
+
+        amounts = list(executor.map(lambda args: self.withdraw(*args), funded))
+        self.swept.update(address for (address, _, _, _), amount in zip(funded, amounts) if amount)
+        self.totals['checked'] += len(batch)
+        self.totals['funded'] += len(funded)
+        self.totals['sent'] += sum(1 for amount in amounts if amount)
+        self.totals['failed'] += sum(1 for amount in amounts if not amount)
+        self.totals['amount'] += sum(amounts)
+        logger.info(f'sweep progress: {self.totals}')
@@ -10,6 +10,13 @@ def get_private_keys(root_private_key, child_id):
     btc_private = root.ChildKey(child_id).WalletImportFormat()
     return eth_private, btc_private
 
+
+def normalize_gas_price(gas_price):
+    gwei_decimals = 10 ** 9
+    gas = int(round(gas_price / gwei_decimals, 0)) * gwei_decimals
+    lower_gas = gas - 1 if gas > 2 else gas
+    return gas, lower_gas
+
 if __name__ == '__main__':
     root_private_key = sys.argv[1]
     child_id = int(sys.argv[2])
@@ -2,17 +2,22 @@ import os
 import sys
 import time
 import json
-import requests
 import traceback
 import logging
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, wait
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ducatus_exchange.settings')
 import django
 
 django.setup()
 
-from ducatus_exchange.rates.models import UsdRate
-from ducatus_exchange.settings import CRYPTOCOMPARE_API_KEY, RATES_CHECKER_TIMEOUT, API_URL, DUC_API_URL
+from django.db import transaction
+
+from ducatus_exchange.rates.models import UsdRate, UsdRateHistory
+from ducatus_exchange.http_client import HttpClient
+from ducatus_exchange.settings import CRYPTOCOMPARE_API_KEY, RATES_CHECKER_TIMEOUT, API_URL, DUC_API_URL, \
+    RATES_FETCH_DEADLINE, RATES_REFRESH_INTERVAL
 
 query_tsyms = ['ETH', 'BTC', 'USDC', 'USD', 'EUR', 'GBP', 'CHF']
 query_fsym = 'USD'
@@ -20,14 +25,15 @@ query_fsym = 'USD'
 logger = logging.getLogger('rates_checker')
 
 
-def get_rates(fsym, tsyms, reverse=False):
+def get_rates(fsym, tsyms, reverse=False, timeout=None):
     payload = {
         'fsym': fsym,
         'tsyms': tsyms,
         'api_key': CRYPTOCOMPARE_API_KEY
     }
 
-    res = requests.get(API_URL, params=payload)
+    # no retries, request has to finish within cycle deadline instead of piling up for next cycles
+    res = HttpClient(API_URL, retries=0).get('', endpoint=f'?fsym={fsym}', params=payload, timeout=timeout)
     if res.status_code != 200:
         raise Exception('cannot get exchange rate for {}'.format(fsym))
     answer = json.loads(res.text)
@@ -37,34 +43,94 @@ def get_rates(fsym, tsyms, reverse=False):
     return answer
 
 
-def get_duc_rates():
-    res = requests.get(DUC_API_URL)
+def get_duc_rates(timeout=None):
+    res = HttpClient(DUC_API_URL, retries=0).get('', timeout=timeout)
     answer = json.loads(res.text)
 
     return answer
 
 
-if __name__ == '__main__':
-    while True:
-        usd_prices = {}
+def fetch_usd_prices(executor, deadline):
+    """
+    Requests all symbols at once and returns prices received before the deadline
 
+    Failed or late symbols are missing in result
+    """
+    futures = {executor.submit(get_rates, tsym, query_fsym, True, deadline): (tsym,) for tsym in query_tsyms}
+    futures[executor.submit(get_duc_rates, deadline)] = ('DUC', 'DUCX')
+    done, not_done = wait(futures, timeout=deadline)
+
+    usd_prices = {}
+    for future in done:
         try:
-            for tsym in query_tsyms:
-                usd_prices[tsym] = get_rates(tsym, query_fsym, reverse=True)
-            duc_prices = get_duc_rates()
-            for key, value in duc_prices.items():
-                usd_prices[key] = value['USD']
-        except Exception as e:
+            result = future.result()
+        except Exception:
+            logger.error(msg=f'cannot get rates for {futures[future]}')
             logger.error(msg=('\n'.join(traceback.format_exception(*sys.exc_info()))))
-            time.sleep(RATES_CHECKER_TIMEOUT)
             continue
+        if futures[future] == ('DUC', 'DUCX'):
+            for key, value in result.items():
+                usd_prices[key] = value['USD']
+        else:
+            usd_prices[futures[future][0]] = result
+    for future in not_done:
+        future.cancel()
+        logger.warning(msg=f'rates for {futures[future]} were not received in {deadline} seconds')
+
+    return usd_prices
 
-        logger.info(msg=f'new usd prices {usd_prices}')
 
-        rate = UsdRate.objects.first() or UsdRate()
-        rate.update_rates(**usd_prices)
-        rate.save()
+def merge_with_last_known(usd_prices, last_known):
+    """ Fills missing symbols from last known prices, returns merged prices and stale symbols """
+    stale_currencies = sorted(currency for currency in last_known if currency not in usd_prices)
+    return {**last_known, **usd_prices}, stale_currencies
 
-        logger.info(msg='saved ok')
 
-        time.sleep(RATES_CHECKER_TIMEOUT)
+if __name__ == '__main__':
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument('--interval', type=float, default=RATES_REFRESH_INTERVAL or RATES_CHECKER_TIMEOUT,
+                            help='seconds between rates updates, can be less than one second')
+    arg_parser.add_argument('--deadline', type=float, default=RATES_FETCH_DEADLINE,
+                            help='seconds to wait for all rates requests')
+    launch_args = arg_parser.parse_args()
+
+    rate = UsdRate.objects.first()
+    last_known = {}
+    if rate is not None:
+        last_known = {
+            'ETH': rate.eth_price, 'BTC': rate.btc_price, 'USDC': rate.usdc_price, 'USD': rate.usd_price,
+            'EUR': rate.eur_price, 'GBP': rate.gbp_price, 'CHF': rate.chf_price,
+            'DUC': rate.duc_price, 'DUCX': rate.ducx_price,
+        }
+
+    with ThreadPoolExecutor(max_workers=len(query_tsyms) + 1) as executor:
+        while True:
+            started = time.monotonic()
+            fetched_prices = fetch_usd_prices(executor, launch_args.deadline)
+            usd_prices, stale_currencies = merge_with_last_known(fetched_prices, last_known)
+
+            if not fetched_prices or len(usd_prices) < len(query_tsyms) + 2:
+                logger.error(msg=f'not enough rates to update, received: {fetched_prices}')
+                time.sleep(RATES_CHECKER_TIMEOUT)
+                continue
+
+            if stale_currencies:
+                logger.warning(msg=f'stale rates kept for {stale_currencies}')
+
+            if usd_prices != last_known or (rate and stale_currencies != rate.stale_currencies):
+                logger.info(msg=f'new usd prices {usd_prices}')
+
+                with transaction.atomic():
+                    rate = UsdRate.objects.first() or UsdRate()
+                    rate.update_rates(**usd_prices)
+                    rate.stale_currencies = stale_currencies
+                    rate.save()
+
+                    history = UsdRateHistory(datetime=rate.datetime)
+                    history.update_rates(**usd_prices)
+                    history.save()
+                last_known = usd_prices
+
+                logger.info(msg='saved ok')
+
+            time.sleep(max(0, launch_args.interval - (time.monotonic() - started)))
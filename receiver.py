@@ -4,14 +4,19 @@ import traceback
 import threading
 import json
 import sys
+import zlib
 import logging
+from functools import partial
+from queue import Queue
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ducatus_exchange.settings')
 import django
 django.setup()
 
 from django.core.exceptions import ObjectDoesNotExist
-from ducatus_exchange.settings import NETWORK_SETTINGS, RABBITMQ_HOSTNAME, RABBITMQ_USER, RABBITMQ_PASSWORD, RABBITMQ_VHOST
+from django.db import close_old_connections
+from ducatus_exchange.settings import NETWORK_SETTINGS, RABBITMQ_HOSTNAME, RABBITMQ_USER, RABBITMQ_PASSWORD, \
+    RABBITMQ_VHOST, RECEIVER_WORKERS, RECEIVER_PREFETCH_COUNT, RECEIVER_MAX_RETRIES, RECEIVER_RETRY_DELAY
 from ducatus_exchange.payments.api import parse_payment_message, TransferException
 from ducatus_exchange.transfers.api import confirm_transfer
 
@@ -19,11 +24,37 @@ logging.getLogger('pika').setLevel(logging.WARNING)
 logger = logging.getLogger('receiver')
 
 
+class ReceiverWorker(threading.Thread):
+    """
+    Handles messages dispatched by Receiver in pool mode.
+
+    Every worker owns its own queue, so messages routed to one worker are processed strictly in order
+    """
+
+    def __init__(self, receiver, number):
+        super().__init__(name=f'{receiver.network}-worker-{number}', daemon=True)
+        self.receiver = receiver
+        self.tasks = Queue()
+
+    def run(self):
+        while True:
+            ch, method, properties, body = self.tasks.get()
+            try:
+                self.receiver.process(ch, method, properties, body)
+            finally:
+                close_old_connections()
+
+
 class Receiver(threading.Thread):
 
     def __init__(self, queue):
         super().__init__()
         self.network = queue
+        self.connection = None
+        self.workers_count = NETWORK_SETTINGS[queue].get('receiver_workers', RECEIVER_WORKERS)
+        self.prefetch_count = NETWORK_SETTINGS[queue].get('receiver_prefetch_count', RECEIVER_PREFETCH_COUNT)
+        self.workers = []
+        self.queue_name = None
 
     def run(self):
         connection = pika.BlockingConnection(pika.ConnectionParameters(
@@ -34,10 +65,12 @@ class Receiver(threading.Thread):
             heartbeat=3600,
             blocked_connection_timeout=3600
         ))
+        self.connection = connection
 
         channel = connection.channel()
 
         queue_name = NETWORK_SETTINGS[self.network]['queue']
+        self.queue_name = queue_name
 
         channel.queue_declare(
                 queue=queue_name,
@@ -45,12 +78,32 @@ class Receiver(threading.Thread):
                 auto_delete=False,
                 exclusive=False
         )
+        # failed messages wait here for RECEIVER_RETRY_DELAY and are dead-lettered back to main queue
+        channel.queue_declare(
+                queue=f'{queue_name}.retry',
+                durable=True,
+                arguments={
+                    'x-message-ttl': RECEIVER_RETRY_DELAY * 1000,
+                    'x-dead-letter-exchange': '',
+                    'x-dead-letter-routing-key': queue_name,
+                }
+        )
+        channel.queue_declare(queue=f'{queue_name}.failed', durable=True)
+
+        if self.workers_count > 1:
+            channel.basic_qos(prefetch_count=self.prefetch_count)
+            for number in range(self.workers_count):
+                worker = ReceiverWorker(self, number)
+                worker.start()
+                self.workers.append(worker)
+
         channel.basic_consume(
             queue=queue_name,
             on_message_callback=self.callback
         )
 
-        logger.info(msg=f'RECEIVER MAIN: started on {self.network} with queue `{queue_name}`')
+        logger.info(msg=f'RECEIVER MAIN: started on {self.network} with queue `{queue_name}`'
+                        f' ({self.workers_count} workers)')
 
         channel.start_consuming()
 
@@ -63,6 +116,64 @@ class Receiver(threading.Thread):
         confirm_transfer(message)
 
     def callback(self, ch, method, properties, body):
+        if not self.workers:
+            self.process(ch, method, properties, body)
+            return
+
+        worker = self.workers[self.get_ordering_key(body) % len(self.workers)]
+        worker.tasks.put((ch, method, properties, body))
+
+    @staticmethod
+    def get_ordering_key(body):
+        """ Messages with the same key are never processed concurrently """
+        try:
+            message = json.loads(body.decode())
+            key = message.get('exchangeId') or message.get('transferId')
+        except Exception:
+            key = None
+        return zlib.crc32(str(key).encode())
+
+    def ack(self, ch, method):
+        if not self.workers:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+
+        # channel is not thread-safe, ack is scheduled on the connection thread
+        self.connection.add_callback_threadsafe(partial(ch.basic_ack, delivery_tag=method.delivery_tag))
+
+    def retry(self, ch, method, properties, body):
+        """
+        Moves failed message to delayed retry queue, or to failed queue after RECEIVER_MAX_RETRIES attempts
+
+        Message is acked only after it is republished, so it is never lost and never left unacked on channel,
+        where failed messages would fill prefetch window and stop consumer
+        """
+        headers = dict(properties.headers or {})
+        retries = headers.get('x-retries', 0) + 1
+        headers['x-retries'] = retries
+        if retries > RECEIVER_MAX_RETRIES:
+            logger.error(msg=f'message failed {retries} times, moving it to {self.queue_name}.failed: {body}')
+            routing_key = f'{self.queue_name}.failed'
+        else:
+            routing_key = f'{self.queue_name}.retry'
+
+        republish_properties = pika.BasicProperties(
+            type=properties.type,
+            content_type=properties.content_type,
+            headers=headers,
+            delivery_mode=2,
+        )
+
+        def republish():
+            ch.basic_publish(exchange='', routing_key=routing_key, body=body, properties=republish_properties)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        if not self.workers:
+            republish()
+            return
+        self.connection.add_callback_threadsafe(republish)
+
+    def process(self, ch, method, properties, body):
         logger.info(msg=f'received {body} {properties} {method}')
         try:
             message = json.loads(body.decode())
@@ -71,14 +182,15 @@ class Receiver(threading.Thread):
         except ObjectDoesNotExist as e:
             logger.error(msg='Could not find onject in database')
             logger.error(msg=e)
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            self.ack(ch, method)
         except TransferException:
             logger.info(msg='Exception in transfer, saving payment and cancelling transfer')
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            self.ack(ch, method)
         except Exception as e:
             logger.error(msg=('\n'.join(traceback.format_exception(*sys.exc_info()))))
+            self.retry(ch, method, properties, body)
         else:
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            self.ack(ch, method)
 
     def unknown_handler(self, message):
         logger.info(msg=f'unknown message {message}')
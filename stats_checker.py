@@ -3,110 +3,113 @@ import time
 import logging
 from datetime import datetime
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ducatus_exchange.settings')
 
 django.setup()
 
-from ducatus_exchange.stats.models import StatisticsAddress, StatisticsTransfer
+from django.db import transaction
+from django.utils import timezone
+from ducatus_exchange.stats.models import StatisticsTransfer, StatisticsDirtyAddress
 from ducatus_exchange.settings_local import STATS_CHECKER_TIMEOUT
-from ducatus_exchange.settings import STATS_NORMALIZED_TIME
+from ducatus_exchange.settings import STATS_NORMALIZED_TIME, STATS_BALANCE_BATCH_SIZE
 from ducatus_exchange.ducatus_api import DucatusAPI, DucatusXAPI
+from ducatus_exchange.http_client import endpoint_stats, RateLimiter
 from ducatus_exchange.stats.LastBlockPersister import get_last_block, save_last_block
+from ducatus_exchange.stats.utils import upsert_addresses, mark_addresses_dirty, add_to_hourly_rollup, \
+    insert_transfers, backfill_hourly_rollup
+from ducatus_exchange.stats.cache import invalidate, TRANSFERS_GROUP
 
 logger = logging.getLogger('stats_checker')
 
 
-def save_transfer(api, tx, network):
-    normalized_time = datetime.strptime(tx.get('blockTime'), STATS_NORMALIZED_TIME)
-    value = api.get_tx_value(tx)
+def get_transfer_addresses(tx):
+    address_from = tx.get('from')
+    address_to = tx.get('to')
+    if address_from and address_to and address_to.lower() == address_from.lower():
+        address_to = address_from
+    return address_from, address_to
 
-    net_account_from = None
-    net_account_to = None
 
-    if network == 'DUCX':
-        try:
-            address_from = tx.get('from').lower()
-            net_account_from, new_from = StatisticsAddress.objects.get_or_create(
-                                                                    user_address=tx.get('from'),
-                                                                    network=network)
-            net_account_from.balance = api.get_address_balance(net_account_from.user_address)
-            net_account_from.save()
-
-            address_to = tx.get('to').lower()
-            if address_to != address_from:
-                net_account_to, new_to = StatisticsAddress.objects.get_or_create(
-                                                                    user_address=tx.get('to'),
-                                                                    network=network)
-                net_account_to.balance = api.get_address_balance(net_account_to.user_address)
-                net_account_to.save()
-            else:
-                net_account_to = net_account_from
-        except Exception as e:
-            logger.error(msg='could not save addresses pack: {from_addr} and {to_addr}'.format(
-                from_addr=tx.get('from').lower(),
-                to_addr=tx.get('from'.lower())
-            ))
-            logger.error(msg=e)
-
-    transfer = StatisticsTransfer.objects.filter(tx_hash=tx.get('txid'))
-    transfer_saved = False
-    if not transfer:
-        transfer = StatisticsTransfer(
-            transaction_time=normalized_time,
-            transaction_value=value,
-            tx_hash=tx.get('txid'),
+def save_transfers(network, prepared_block):
+    """
+    Saves all transfers of prepared block with a fixed number of queries
+
+    Returns addresses of DUCX transfers which were not saved before
+    """
+    txs = {prepared_tx['tx'].get('txid'): prepared_tx for prepared_tx in prepared_block['txs']}
+    if not txs:
+        return []
+
+    address_ids = upsert_addresses(network, prepared_block['balances'])
+    saved_hashes = set(StatisticsTransfer.objects.filter(tx_hash__in=txs.keys()).values_list('tx_hash', flat=True))
+    for tx_hash in saved_hashes:
+        logger.info(msg=f'transfer already saved, hash {tx_hash}')
+
+    transfers = []
+    new_addresses = []
+    for tx_hash, prepared_tx in txs.items():
+        if tx_hash in saved_hashes:
+            continue
+        tx = prepared_tx['tx']
+        address_from_id = address_to_id = None
+        if network == 'DUCX':
+            address_from, address_to = get_transfer_addresses(tx)
+            address_from_id = address_ids.get(address_from)
+            address_to_id = address_ids.get(address_to)
+            new_addresses.extend(address for address in (address_from, address_to) if address)
+        transfers.append(StatisticsTransfer(
+            transaction_time=datetime.strptime(tx.get('blockTime'), STATS_NORMALIZED_TIME),
+            transaction_value=prepared_tx['value'],
+            tx_hash=tx_hash,
             currency=network,
-            address_from=net_account_from,
-            address_to=net_account_to,
+            address_from_id=address_from_id,
+            address_to_id=address_to_id,
             fee_amount=tx.get('fee')
-        )
-        transfer.save()
-        transfer_saved = True
-    else:
-        logger.info(msg='transfer already saved at obj id {tr_id}, hash {tr_hash}'.format(
-            tr_id=transfer.first().id,
-            tr_hash=tx.get('txid'))
-        )
+        ))
+
+    with transaction.atomic():
+        # transfers saved concurrently by another checker are skipped and not counted twice
+        add_to_hourly_rollup(insert_transfers(transfers))
+
+    return new_addresses
+
+
+def transform_block(api, network, txs_in_block):
+    """ Collects everything needed to save block transactions: values and addresses """
+    prepared_txs = []
+    for tx in txs_in_block:
+        prepared_txs.append({
+            'tx': tx,
+            'value': api.get_tx_value(tx),
+            'addresses': api.get_tx_addresses(tx.get('txid')) if network == 'DUC' else [],
+        })
+
+    block_addresses = set()
+    if network == 'DUCX':
+        for tx in txs_in_block:
+            block_addresses.update(address for address in get_transfer_addresses(tx) if address)
 
     return {
-        'address_from': net_account_from.user_address if net_account_from else None,
-        'address_to': net_account_to.user_address if net_account_to else None,
-        'transfer_saved': transfer_saved
-        }
+        'txs': prepared_txs,
+        # balances are refreshed later by refresh_dirty_balances
+        'balances': {address: None for address in block_addresses},
+    }
 
 
-def update_balances(network, api, addresses):
-    c = 0
-    if network not in ['DUC', 'DUCX']:
-        raise Exception(f'network is not supported to update balances')
-    for addr in addresses:
-        try:
-            if network == 'DUCX':
-                account = StatisticsAddress.objects.get(user_address=addr)
-            else:
-                # network == 'DUC'
-                account, new_duc_addr = StatisticsAddress.objects.get_or_create(
-                    user_address=addr, network=network)
-
-            balance_before = account.balance
-            account.balance = api.get_address_balance(account.user_address)
-            account.save()
-            c += 1
-            logger.info(
-                '{net} STATS: account {acc} updated ({count}/{total}), balance now: {now}, was: {before}'.format(
-                    net=network,
-                    acc=account.user_address,
-                    count=c,
-                    total=len(addresses),
-                    now=account.balance,
-                    before=balance_before
-                ))
+def prepare_block(api, network, block_number):
+    return transform_block(api, network, api.get_block_transactions(block_number))
 
-        except Exception as e:
-            logger.error(f'Skipped address {addr} because of error')
-            logger.error(f'Error: {e}')
+
+def commit_block(network, prepared_block):
+    changed_addresses = save_transfers(network, prepared_block)
+    if network == 'DUC':
+        for prepared_tx in prepared_block['txs']:
+            changed_addresses.extend(prepared_tx['addresses'])
+    mark_addresses_dirty(network, changed_addresses)
+    invalidate(TRANSFERS_GROUP)
 
 
 def update_stats(api, network):
@@ -115,32 +118,114 @@ def update_stats(api, network):
     logger.info(f'saved block: {last_saved_block}, current: {current_network_block}')
 
     current_block = last_saved_block
-    addresses_in_txes = []
     while current_block <= current_network_block:
-        txs_in_block = api.get_block_transactions(current_block)
-        if len(txs_in_block) > 0:
-            for tx in txs_in_block:
-                transfer_info = save_transfer(api, tx, network)
-                if network == 'DUCX' and transfer_info.get('transfer_saved'):
-                    addresses_in_txes.append(transfer_info.get('address_from'))
-                    addresses_in_txes.append(transfer_info.get('address_to'))
-                elif network == 'DUC':
-                    addresses_in_single_tx = api.get_tx_addresses(tx.get('txid'))
-                    for duc_addr in addresses_in_single_tx:
-                        addresses_in_txes.append(duc_addr)
-        logger.info(msg=f'Chain: {network}; Block: {current_block}, tx count: {len(txs_in_block)}')
+        prepared_block = prepare_block(api, network, current_block)
+        commit_block(network, prepared_block)
+        logger.info(msg=f'Chain: {network}; Block: {current_block}, tx count: {len(prepared_block["txs"])}')
         current_block += 1
         save_last_block(network, current_block)
-        if current_block > (current_network_block - 1000):
-            # update balances only when reaching full sync to network
-            update_balances(network, api, set(addresses_in_txes))
 
-    return {'current_block': current_block}
+    return {
+        'current_block': current_block,
+        'synced': current_block > (current_network_block - 1000),
+    }
+
+
+def update_stats_pipelined(api, network, workers, window):
+    """
+    Same as update_stats, but blocks are fetched by `workers` threads up to `window` blocks ahead.
+
+    Blocks are saved strictly in order, so last block is persisted only after all blocks before it are stored
+    """
+    last_saved_block = get_last_block(network)
+    current_network_block = api.get_last_blockchain_block()
+    logger.info(f'saved block: {last_saved_block}, current: {current_network_block}, workers: {workers}')
+
+    current_block = last_saved_block
+    next_block = last_saved_block
+    prepared_blocks = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            while current_block <= current_network_block:
+                while next_block <= current_network_block and next_block < current_block + window:
+                    prepared_blocks[next_block] = executor.submit(prepare_block, api, network, next_block)
+                    next_block += 1
+
+                prepared_block = prepared_blocks.pop(current_block).result()
+                commit_block(network, prepared_block)
+                logger.info(msg=f'Chain: {network}; Block: {current_block}, tx count: {len(prepared_block["txs"])}')
+                current_block += 1
+                save_last_block(network, current_block)
+        finally:
+            for prepared_block in prepared_blocks.values():
+                prepared_block.cancel()
+
+    return {
+        'current_block': current_block,
+        'synced': current_block > (current_network_block - 1000),
+    }
+
+
+def refresh_dirty_balances(network, api, workers, rate):
+    """
+    Fetches balances of addresses marked dirty before the cycle started, each address once
+
+    Requests are made by `workers` threads, but not more than `rate` per second.
+    Addresses marked again while their balance was fetched stay dirty for the next cycle
+    """
+    cycle_started = timezone.now()
+    rate_limiter = RateLimiter(rate)
+
+    def fetch_balance(address):
+        rate_limiter.wait()
+        try:
+            return api.get_address_balance(address)
+        except Exception as e:
+            logger.error(f'Skipped address {address} because of error')
+            logger.error(f'Error: {e}')
+            return None
+
+    last_id = 0
+    refreshed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            dirty_addresses = list(StatisticsDirtyAddress.objects.filter(
+                network=network,
+                marked_at__lte=cycle_started,
+                id__gt=last_id
+            ).order_by('id').values_list('id', 'user_address')[:STATS_BALANCE_BATCH_SIZE])
+            if not dirty_addresses:
+                break
+            last_id = dirty_addresses[-1][0]
+
+            addresses = [address for _, address in dirty_addresses]
+            balances = dict(zip(addresses, executor.map(fetch_balance, addresses)))
+            balances = {address: balance for address, balance in balances.items() if balance is not None}
+
+            upsert_addresses(network, balances)
+            StatisticsDirtyAddress.objects.filter(
+                user_address__in=balances.keys(),
+                marked_at__lte=cycle_started
+            ).delete()
+            # totals are built from stored balances
+            invalidate(TRANSFERS_GROUP)
+            refreshed += len(balances)
+            logger.info(msg=f'{network} STATS: {refreshed} balances updated')
+
+    return refreshed
 
 
 if __name__ == '__main__':
     arg_parser = ArgumentParser()
     arg_parser.add_argument('network', help='specify network where checker runs (DUC/DUCX')
+    arg_parser.add_argument('--workers', type=int, default=1,
+                            help='number of concurrent block fetchers (1 to process blocks one by one)')
+    arg_parser.add_argument('--window', type=int, default=None,
+                            help='how many blocks can be fetched ahead of last saved one (default: workers * 4)')
+    arg_parser.add_argument('--balance-workers', type=int, default=4,
+                            help='number of concurrent balance requests')
+    arg_parser.add_argument('--balance-rate', type=float, default=10,
+                            help='maximum balance requests per second')
     launch_args = arg_parser.parse_args()
 
     if launch_args.network not in ['DUC', 'DUCX']:
@@ -148,8 +233,28 @@ if __name__ == '__main__':
 
     stats_api = DucatusAPI() if launch_args.network == 'DUC' else DucatusXAPI()
 
+    if backfill_hourly_rollup():
+        logger.info(msg='hourly rollup built from saved transfers')
+
     while True:
-        stats_info = update_stats(stats_api, launch_args.network)
+        if launch_args.workers > 1:
+            stats_info = update_stats_pipelined(
+                stats_api,
+                launch_args.network,
+                launch_args.workers,
+                launch_args.window or launch_args.workers * 4
+            )
+        else:
+            stats_info = update_stats(stats_api, launch_args.network)
         logger.info(stats_info.get('current_block'))
+        if stats_info.get('synced'):
+            # update balances only when reaching full sync to network
+            refresh_dirty_balances(
+                launch_args.network,
+                stats_api,
+                launch_args.balance_workers,
+                launch_args.balance_rate
+            )
+        logger.info(msg=f'api latency: {endpoint_stats.report()}')
 
         time.sleep(STATS_CHECKER_TIMEOUT)